@@ -0,0 +1,96 @@
+# Times the /play suggestions served from the title index. The index is filled with made up song titles, saved to and
+# loaded back from a throwaway metadata cache, then queried with what a user would have typed after each keystroke
+# of a title they've played before, with and without a typo. Suggestions should come back well under 50ms.
+#
+# usage: python -m benchmarks.autocomplete_benchmark [--titles 50000] [--queries 500]
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+WORDS = (
+    "love night heart fire dream dance baby girl boy summer rain light dark blue gold city lost home road star moon sun "
+    "wild young forever alone together crazy sweet bad good never again tonight remix live official video lyrics acoustic "
+    "feat cover version radio edit extended mix original slowed reverb sped up loop hour"
+).split()
+
+
+def makeTitle(rng: random.Random) -> str:
+    artist = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10))).title()
+    return f"{artist} - {' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).title()}"
+
+
+# function to make a typo by swapping two letters, like a fast typist would
+def addTypo(text: str, rng: random.Random) -> str:
+    if len(text) < 4:
+        return text
+    i = rng.randrange(1, len(text) - 2)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2 :]
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args):
+    from scripts.title_index import TitleIndex
+
+    rng = random.Random(1)
+    titles = [makeTitle(rng) for _ in range(args.titles)]
+    rows = [(f"youtube:{i:011d}", title, f"https://www.youtube.com/watch?v={i:011d}", rng.randint(120, 400)) for i, title in enumerate(titles)]
+
+    index = TitleIndex()
+    start = time.perf_counter()
+    index.cache.putTitles(rows)
+    saved = time.perf_counter() - start
+
+    # tracing allocations slows loading down a lot, so the memory is measured on a second load
+    index = TitleIndex()
+    start = time.perf_counter()
+    await index.load()
+    loaded = time.perf_counter() - start
+    tracemalloc.start()
+    index = TitleIndex()
+    await index.load()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    timings = {"as typed": [], "with a typo": []}
+    hits = {"as typed": 0, "with a typo": 0}
+    for title in rng.sample(titles, args.queries):
+        # what the user has typed after each keystroke, from the third one on
+        for end in range(3, len(title) + 1):
+            typed = title[:end]
+            for kind, query in (("as typed", typed), ("with a typo", addTypo(typed, rng))):
+                start = time.perf_counter()
+                results = index.search(query)
+                timings[kind].append(time.perf_counter() - start)
+                if end == len(title):
+                    hits[kind] += any(result[0] == title for result in results)
+
+    print(f"{len(index)} titles: saved in {saved:.2f}s, loaded and indexed in {loaded:.2f}s, {memory / 2**20:.1f}MB ({memory / len(index):.0f}B per title)\n")
+    for kind, values in timings.items():
+        print(
+            f"{kind:<12} {len(values)} keystrokes  p50 {percentile(values, 0.5) * 1000:.2f}ms  p99 {percentile(values, 0.99) * 1000:.2f}ms  "
+            f"max {max(values) * 1000:.2f}ms  mean {statistics.mean(values) * 1000:.2f}ms  full title found {hits[kind] / args.queries:.0%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the /play suggestions.")
+    parser.add_argument("--titles", type=int, default=50000, help="song titles in the index")
+    parser.add_argument("--queries", type=int, default=500, help="titles typed out one keystroke at a time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["METADATA_CACHE_PATH"] = os.path.join(directory, "metadata_cache.db")
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Shows how many music controllers the bot keeps around and the memory they hold, against the stand-ins in
+# benchmarks/fakes.py. Three things are measured:
+#   voice traffic  - members joining and leaving voice channels in guilds that never used the bot, which used to
+#                    create a controller per guild and now creates none
+#   busy guilds    - more guilds using commands than CONTROLLER_LIMIT allows, each one setting up 24/7 and then
+#                    emptying its channel, the least recently used idle controllers are let go of
+#   idle sweep     - everything left after the idle TTL runs out, the 24/7 channels stay remembered and the first
+#                    member to join one brings its controller back
+# Some of the busy guilds also play a song first, so their channel gets a "Now Playing" message with buttons. Those
+# views never time out and are kept for good, like discord.py does, and the report counts the controllers that are
+# still alive after they were let go of, which should be none.
+#
+# usage: python -m benchmarks.controller_memory_benchmark [--guilds 5000] [--limit 500] [--now-playing 1000]
+import argparse
+import asyncio
+import collections
+import gc
+import logging
+import os
+import tempfile
+import tracemalloc
+import types
+
+from benchmarks.fakes import FakeChannel, FakeClient, FakeGuild, FakeUser, FakeVoiceChannel, FakeVoiceState, installFakeAudio
+
+
+def makeGuild(guild_id: int, client: FakeClient, views: list) -> tuple:
+    guild = FakeGuild(guild_id)
+    voice_channel = FakeVoiceChannel(guild_id * 10 + 1, guild, client)
+    text_channel = FakeChannel(guild_id * 10 + 2, latency=0, views=views)
+    guild.channels = {voice_channel.id: voice_channel, text_channel.id: text_channel}
+    return guild, voice_channel, text_channel
+
+
+# function to get the memory python has allocated right now, after dropping whatever is unreachable
+def tracedMemory() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+async def joinAndLeave(venusbot, guild, voice_channel):
+    member = FakeUser(guild.id * 10 + 3, guild=guild)
+    voice_channel.members.append(member)
+    await venusbot.on_voice_state_update(member, FakeVoiceState(), FakeVoiceState(voice_channel))
+    voice_channel.members.remove(member)
+    await venusbot.on_voice_state_update(member, FakeVoiceState(voice_channel), FakeVoiceState())
+
+
+# function to play one song in a guild, which sends its "Now Playing" message with the music buttons
+async def playOneSong(musicController, guild_id: int):
+    from music_controller import Song
+
+    url = f"https://www.youtube.com/watch?v=fake{guild_id:07d}"
+    musicController.links.put(url, f"https://rr1---sn-fake.googlevideo.com/videoplayback?expire={2**31 - 1}&id={guild_id}", "opus")
+    musicController.songQueue.append(Song(f"Fake Song {guild_id}", url, None, 180, None))
+    await musicController.playSong()
+
+
+# function to count the music controllers that still exist, whether or not the bot still has them
+def liveControllers(MusicController) -> int:
+    gc.collect()
+    return sum(isinstance(thing, MusicController) for thing in gc.get_objects())
+
+
+async def run(args):
+    import venusbot
+    from music_controller import MusicController
+    from scripts import metrics, spotify
+    from scripts.message_scheduler import getMessageScheduler
+
+    client = FakeClient()
+    # the handlers look the bot up as a module global, so swap in a fake client that shares VenusBot's controller handling
+    client.musicControllers = collections.OrderedDict()
+    client.snapshots = types.SimpleNamespace(pending={})
+    client.controllerTTL = args.ttl
+    client.controllerLimit = args.limit
+    for name in ("getGuildMusicController", "popGuildMusicController", "evictIdleControllers"):
+        setattr(client, name, types.MethodType(getattr(venusbot.VenusBot, name), client))
+    venusbot.bot = client
+    # the views that never time out, kept for as long as the bot runs
+    views = []
+    guilds = [makeGuild(guild_id, client, views) for guild_id in range(1, args.guilds + 1)]
+
+    def line(stage: str, memory: int, controllers: int = None):
+        controllers = len(client.musicControllers) if controllers is None else controllers
+        evictions = ", ".join(f"{reason}: {int(count)}" for (reason,), count in sorted(metrics.CONTROLLER_EVICTIONS.values.items())) or "none"
+        return f"{stage:<34} {controllers:>6} controllers  {len(client.snapshots.pending):>6} remembered  {(memory - baseline) / 2**20:7.2f}MB  evicted {evictions}"
+
+    tracemalloc.start()
+    baseline = tracedMemory()
+
+    # what a controller per guild used to cost, the way on_voice_state_update created them
+    old = [MusicController(client=client, guild=guild) for guild, _, _ in guilds]
+    print(line("a controller per guild (before)", tracedMemory(), len(old)))
+    del old
+
+    for guild, voice_channel, _ in guilds:
+        await joinAndLeave(venusbot, guild, voice_channel)
+    print(line("voice traffic in every guild", tracedMemory()))
+
+    peak = 0
+    for guild, voice_channel, text_channel in guilds:
+        musicController = await client.getGuildMusicController(guild)
+        await musicController.two_four_seven(voice_channel, text_channel)
+        if guild.id <= args.now_playing:
+            await playOneSong(musicController, guild.id)
+        await musicController.softDisconnect()
+        peak = max(peak, len(client.musicControllers))
+    print(line(f"/247 in every guild (peak {peak})", tracedMemory()))
+
+    for musicController in client.musicControllers.values():
+        musicController.lastUsed -= args.ttl
+    # the loop variable would otherwise keep the last controller alive
+    del musicController
+    client.evictIdleControllers()
+    print(line("after the idle TTL", tracedMemory()))
+    # wait for every Now Playing message to go out, so its view is in the store
+    messageScheduler = getMessageScheduler()
+    while messageScheduler.outboxes:
+        await asyncio.sleep(0.01)
+    print(f"{'':<34} {liveControllers(MusicController):>6} controllers still alive, {len(views)} Now Playing views kept")
+
+    for guild, voice_channel, _ in guilds[: args.limit // 10]:
+        await joinAndLeave(venusbot, guild, voice_channel)
+    print(line(f"members rejoin {args.limit // 10} 24/7 channels", tracedMemory()))
+    restored = all(client.musicControllers[guild.id].voiceChannel is voice_channel for guild, voice_channel, _ in guilds[: args.limit // 10])
+    print(f"\n24/7 channels restored: {'yes' if restored else 'no'}")
+
+    tracemalloc.stop()
+    for voice_client in list(client.voice_clients):
+        await voice_client.disconnect(force=True)
+    await spotify.closeSession()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory report of the music controllers kept by the bot.")
+    parser.add_argument("--guilds", type=int, default=5000, help="guilds the bot is in")
+    parser.add_argument("--limit", type=int, default=500, help="CONTROLLER_LIMIT, most controllers kept at once")
+    parser.add_argument("--ttl", type=int, default=1800, help="CONTROLLER_IDLE_TTL, seconds an idle controller is kept")
+    parser.add_argument("--now-playing", type=int, default=1000, help="guilds that play a song before their channel empties")
+    args = parser.parse_args()
+
+    # keep the bot's logging out of bot_log.log and the report
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["METADATA_CACHE_PATH"] = os.path.join(directory, "metadata_cache.db")
+        os.environ["SNAPSHOT_PATH"] = os.path.join(directory, "queue_snapshots.json.gz")
+        # the Now Playing messages shouldn't be held back by discord's rate limits here
+        os.environ.setdefault("MESSAGE_SEND_RATE", "100000")
+        installFakeAudio(180)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# Offline stand-ins for YouTube, Spotify and Discord, shared by the benchmarks that drive the whole bot pipeline.
+#   FakeYoutubeDL   - replaces yt-dlp with canned results, a configurable latency and failure rate
+#   FakeSpotify     - a local aiohttp server for the token, track and playlist endpoints
+#   Fake* discord   - just enough of a client, guild, channels, voice client and interaction for MusicController and
+#                     the slash commands, with audio sources read at real-time pace by one shared audio thread
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+
+import discord
+from aiohttp import web
+from yt_dlp.utils import DownloadError
+
+from scripts import ytDLP
+
+STREAM_LINK_LIFETIME = 6 * 60 * 60
+
+
+def fakeVideoId(key: str) -> str:
+    return hashlib.md5(key.encode()).hexdigest()[:11]
+
+
+class FakeYoutubeDL:
+    def __init__(self, profile: str, latency: float, failure_rate: float, playlist_size: int, duration: int = None):
+        self.profile = profile
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.playlist_size = playlist_size
+        # every song reports this length when set, so it matches the fake audio sources
+        self.duration = duration
+
+    def video(self, key: str) -> dict:
+        video_id = fakeVideoId(key)
+        return {
+            "title": f"Fake Song {video_id}",
+            "duration": self.duration or 180 + int(video_id, 16) % 120,
+            "thumbnail": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+            "url": f"https://rr1---sn-fake.googlevideo.com/videoplayback?expire={int(time.time()) + STREAM_LINK_LIFETIME}&id={video_id}&itag=251",
+            "acodec": "opus",
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        }
+
+    def playlist(self, url: str) -> dict:
+        entries = []
+        for i in range(self.playlist_size):
+            video = self.video(f"{url}#{i}")
+            entries.append({"url": video["webpage_url"], "title": video["title"], "duration": video["duration"], "thumbnail": video["thumbnail"]} if self.profile == "flat_playlist" else video)
+        return {"title": "Fake Playlist", "entries": entries, "thumbnail": None}
+
+    # blocks like the real extractor does, so it ties up the extraction threads the same way
+    def extract_info(self, url: str, download: bool = False) -> dict:
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.failure_rate:
+            raise DownloadError(f"fake extraction failure for {url}")
+        if self.profile in ("flat_playlist", "playlist"):
+            return self.playlist(url)
+        if self.profile == "flat_search":
+            return {"entries": [self.video(f"{url}#{i}") for i in range(10)]}
+        if self.profile == "search":
+            return {"entries": [self.video(url)]}
+        return self.video(url)
+
+
+# function to make every VideoSearcher lookup use FakeYoutubeDL instead of yt-dlp
+def installFakeYoutubeDL(latency: float, failure_rate: float = 0, playlist_size: int = 100, duration: int = None):
+    ytDLP.getYoutubeDL = lambda profile, cookies_path: FakeYoutubeDL(profile, latency, failure_rate, playlist_size, duration)
+
+
+class FakeSpotify:
+    def __init__(self, latency: float = 0.02, playlist_size: int = 100):
+        self.latency = latency
+        self.playlist_size = playlist_size
+        self.requests = 0
+        self.runner = None
+
+    def track(self, track_id: str) -> dict:
+        return {"id": track_id, "name": f"Spotify Song {track_id}", "artists": [{"name": f"Artist {int(track_id, 16) % 50}"}]}
+
+    def page(self, playlist_id: str, offset: int, limit: int) -> dict:
+        end = min(self.playlist_size, offset + limit)
+        items = [{"track": self.track(fakeVideoId(f"{playlist_id}#{i}"))} for i in range(offset, end)]
+        return {"items": items, "next": None, "total": self.playlist_size, "limit": limit}
+
+    async def respond(self, data: dict) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response(data)
+
+    async def token(self, request: web.Request) -> web.Response:
+        return await self.respond({"access_token": "fake-token", "expires_in": 3600})
+
+    async def tracks(self, request: web.Request) -> web.Response:
+        return await self.respond({"tracks": [self.track(track_id) for track_id in request.query["ids"].split(",")]})
+
+    async def playlist(self, request: web.Request) -> web.Response:
+        playlist_id = request.match_info["id"]
+        return await self.respond({"name": f"Fake Playlist {playlist_id}", "images": [], "tracks": self.page(playlist_id, 0, 100)})
+
+    async def playlistTracks(self, request: web.Request) -> web.Response:
+        page = self.page(request.match_info["id"], int(request.query.get("offset", 0)), int(request.query.get("limit", 100)))
+        return await self.respond(page)
+
+    # function to start the server and point the bot's spotify settings at it, must run before the spotify controller is created
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/api/token", self.token)
+        app.router.add_get("/v1/tracks", self.tracks)
+        app.router.add_get("/v1/playlists/{id}", self.playlist)
+        app.router.add_get("/v1/playlists/{id}/tracks", self.playlistTracks)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        base_url = f"http://127.0.0.1:{port}"
+        os.environ["SPOTIFY_API_URL"] = f"{base_url}/v1"
+        os.environ["SPOTIFY_TOKEN_URL"] = f"{base_url}/api/token"
+        for name in ("SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "SPOTIFY_CLIENT_REFRESH_TOKEN"):
+            os.environ[name] = "fake"
+        return base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+class FakeAvatar:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False, guild=None):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.bot = bot
+        self.avatar = FakeAvatar()
+        # members also carry their guild and voice state
+        self.guild = guild
+        self.voice = None
+
+
+class FakeVoiceState:
+    def __init__(self, channel=None):
+        self.channel = channel
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel):
+        self.id = message_id
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        self.channel.edits += 1
+        await asyncio.sleep(self.channel.latency)
+        return self
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, latency: float = 0.02, views: list = None):
+        self.id = channel_id
+        self.name = f"channel{channel_id}"
+        self.latency = latency
+        self.members = []
+        self.sent = 0
+        self.edits = 0
+        # when given, views that never time out are kept here for good, like discord.py's view store does
+        self.views = views
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        self.sent += 1
+        view = kwargs.get("view")
+        if self.views is not None and view is not None and view.timeout is None:
+            self.views.append(view)
+        await asyncio.sleep(self.latency)
+        return FakeMessage(self.sent, self)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, channels: list = ()):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+        self.channels = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeClient:
+    def __init__(self):
+        self.user = FakeUser(0, bot=True)
+        self.voice_clients = []
+        self.loop = asyncio.get_running_loop()
+        # MusicButtons keeps a reference to the command tree
+        self.tree = None
+
+
+class FakeAudioSource(discord.AudioSource):
+    # stands in for FFmpegOpusAudio/FFmpegPCMAudio, it runs out after the configured number of seconds
+    seconds = 5.0
+    spawned = 0
+
+    def __init__(self, link: str, codec: str = None, before_options: str = None, options: str = None):
+        FakeAudioSource.spawned += 1
+        self.frames = int(self.seconds * 50)
+        self.opus = not isinstance(self, FakeAudioSourcePCM)
+
+    def read(self) -> bytes:
+        if self.frames <= 0:
+            return b""
+        self.frames -= 1
+        return b"\xf8\xff\xfe" if self.opus else bytes(3840)
+
+    def is_opus(self) -> bool:
+        return self.opus
+
+
+class FakeAudioSourcePCM(FakeAudioSource):
+    pass
+
+
+# function to make createAudioSource build fake sources instead of spawning ffmpeg
+def installFakeAudio(seconds: float):
+    FakeAudioSource.seconds = seconds
+    discord.FFmpegOpusAudio = FakeAudioSource
+    discord.FFmpegPCMAudio = FakeAudioSourcePCM
+
+
+class FakeVoiceClient:
+    # totals across every voice client, conflicts are play() calls while something is already playing, which discord rejects
+    plays = 0
+    conflicts = 0
+
+    def __init__(self, client: FakeClient, channel):
+        self.client = client
+        self.channel = channel
+        self.guild = channel.guild
+        self.source = None
+        self.after = None
+        self.paused = False
+        self.connected = True
+        self.lock = threading.Lock()
+
+    def play(self, source: discord.AudioSource, after=None):
+        with self.lock:
+            if self.source is not None:
+                FakeVoiceClient.conflicts += 1
+                raise discord.ClientException("Already playing audio.")
+            self.source = source
+            self.after = after
+            self.paused = False
+            FakeVoiceClient.plays += 1
+
+    # called by the audio thread every 20ms, like discord's player reads one frame
+    def tick(self):
+        with self.lock:
+            if self.source is None or self.paused:
+                return
+            if self.source.read():
+                return
+            after = self.finish()
+        if after is not None:
+            after(None)
+
+    def finish(self):
+        self.source.cleanup()
+        self.source = None
+        after, self.after = self.after, None
+        return after
+
+    def stop(self):
+        with self.lock:
+            after = self.finish() if self.source is not None else None
+        if after is not None:
+            after(None)
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def is_playing(self) -> bool:
+        return self.source is not None and not self.paused
+
+    def is_paused(self) -> bool:
+        return self.source is not None and self.paused
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def disconnect(self, force: bool = False):
+        self.stop()
+        self.connected = False
+        if self in self.client.voice_clients:
+            self.client.voice_clients.remove(self)
+        if self.client.user in self.channel.members:
+            self.channel.members.remove(self.client.user)
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id: int, guild, client: FakeClient):
+        self.id = channel_id
+        self.name = f"voice{channel_id}"
+        self.guild = guild
+        self.client = client
+        self.members = []
+
+    async def connect(self) -> FakeVoiceClient:
+        voice_client = FakeVoiceClient(self.client, self)
+        self.client.voice_clients.append(voice_client)
+        self.members.append(self.client.user)
+        return voice_client
+
+
+class FakeAudioThread(threading.Thread):
+    # one thread feeds every fake voice client, reading a frame from each playing source every 20ms
+    def __init__(self, client: FakeClient):
+        super().__init__(daemon=True, name="fake-audio")
+        self.client = client
+        self.running = True
+
+    def run(self):
+        next_tick = time.perf_counter()
+        while self.running:
+            for voice_client in list(self.client.voice_clients):
+                voice_client.tick()
+            next_tick += 0.02
+            time.sleep(max(0, next_tick - time.perf_counter()))
+
+
+class FakeResponse:
+    def __init__(self, channel: FakeChannel):
+        self.channel = channel
+        self.resource = None
+
+    async def send_message(self, content: str = None, **kwargs):
+        self.resource = await self.channel.send(content, **kwargs)
+        return self
+
+    async def defer(self, **kwargs):
+        return None
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeUser, guild: FakeGuild, channel: FakeChannel):
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.response = FakeResponse(channel)
@@ -0,0 +1,259 @@
+# Runs many guilds at once through the real slash commands and MusicController, against the stand-ins in
+# benchmarks/fakes.py. Each guild gets a voice channel, a text channel and a few members who join, leave and use
+# /play (searches and playlists), /skip, /queue and /shuffle at random. The fake voice clients read their audio at
+# real-time pace on one shared audio thread, so songs end and the next one starts the way they do in discord.
+#
+# The guild count grows in stages (the guilds of earlier stages keep running) and every stage reports:
+#   loop lag       - how late a 50ms sleep on the event loop wakes up, p50/p99/max
+#   cpu            - process cpu time over wall time, 100% is one core
+#   rss            - resident memory at the end of the stage
+#   track gap      - silence between one song ending and the next one starting (venus_playback_gap_seconds)
+#   tracks         - songs started, plus play() calls rejected because something was already playing
+#   messages       - channel messages sent / merged / dropped by the message scheduler
+#   errors         - commands turned away because the extraction threads were saturated, commands that raised
+#                    otherwise, and errors logged by the bot
+#
+# usage: python -m benchmarks.load_simulator [--guilds 25,50,100] [--duration 30] [--track-seconds 8] [--interval 3]
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import logging
+import os
+import random
+import tempfile
+import time
+import types
+
+from benchmarks.fakes import (
+    FakeAudioThread,
+    FakeChannel,
+    FakeClient,
+    FakeGuild,
+    FakeInteraction,
+    FakeUser,
+    FakeVoiceChannel,
+    FakeVoiceClient,
+    FakeVoiceState,
+    installFakeAudio,
+    installFakeYoutubeDL,
+)
+from scripts.extraction_scheduler import ExtractionBusyError
+
+MEMBERS_PER_GUILD = 3
+# how often each guild does what, roughly how a busy server uses the bot
+ACTIONS = {"play": 6, "playlist": 1, "skip": 2, "queue": 2, "shuffle": 1, "voice": 2}
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def residentMemory() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class SimulatedGuild:
+    def __init__(self, guild_id: int, client: FakeClient, channel_latency: float):
+        self.text_channel = FakeChannel(guild_id * 10 + 1, channel_latency)
+        self.guild = FakeGuild(guild_id, [self.text_channel])
+        self.voice_channel = FakeVoiceChannel(guild_id * 10 + 2, self.guild, client)
+        self.guild.channels[self.voice_channel.id] = self.voice_channel
+        self.members = [FakeUser(guild_id * 100 + i, guild=self.guild) for i in range(MEMBERS_PER_GUILD)]
+        for member in self.members:
+            member.voice = FakeVoiceState()
+        self.plays = 0
+
+    def interaction(self, member: FakeUser) -> FakeInteraction:
+        return FakeInteraction(member, self.guild, self.text_channel)
+
+
+class LoadSimulator:
+    def __init__(self, args, venusbot):
+        self.args = args
+        self.venusbot = venusbot
+        self.bot = venusbot.bot
+        self.guilds = []
+        self.errors = 0
+        self.busy = 0
+        self.commands = 0
+        self.tasks = []
+        self.running = True
+
+    # function to move a member in or out of the guild's voice channel and let the bot react like it would to discord
+    async def toggleVoice(self, sim: SimulatedGuild, member: FakeUser):
+        before = FakeVoiceState(member.voice.channel)
+        if before.channel is None:
+            sim.voice_channel.members.append(member)
+            member.voice = FakeVoiceState(sim.voice_channel)
+        else:
+            sim.voice_channel.members.remove(member)
+            member.voice = FakeVoiceState()
+        await self.venusbot.on_voice_state_update(member, before, member.voice)
+
+    async def runCommand(self, sim: SimulatedGuild, action: str):
+        member = random.choice(sim.members)
+        commands = self.venusbot
+        if action == "voice":
+            await self.toggleVoice(sim, member)
+        elif action == "play":
+            await commands.play.callback(sim.interaction(member), f"load test song {sim.guild.id} {random.randrange(1000)}")
+        elif action == "playlist":
+            sim.plays += 1
+            await commands.play.callback(sim.interaction(member), f"https://www.youtube.com/playlist?list=PLload{sim.guild.id}x{sim.plays}")
+        else:
+            await getattr(commands, action).callback(sim.interaction(member))
+
+    # function to replay random commands for one guild until the run ends
+    async def traffic(self, sim: SimulatedGuild):
+        # everyone joins and someone turns on 24/7, which is how the bot normally ends up in a channel
+        for member in sim.members:
+            await self.toggleVoice(sim, member)
+        await self.venusbot.two_four_seven.callback(sim.interaction(sim.members[0]), sim.voice_channel)
+        names, weights = list(ACTIONS), list(ACTIONS.values())
+        while self.running:
+            await asyncio.sleep(random.expovariate(1 / self.args.interval))
+            action = random.choices(names, weights)[0]
+            self.commands += 1
+            try:
+                await self.runCommand(sim, action)
+            except ExtractionBusyError:
+                self.busy += 1
+            except Exception as e:
+                self.errors += 1
+                logging.debug(f"{action} failed in {sim.guild}: {e}")
+
+    async def addGuilds(self, count: int):
+        while len(self.guilds) < count:
+            sim = SimulatedGuild(len(self.guilds) + 1, self.bot, self.args.channel_latency)
+            self.guilds.append(sim)
+            self.tasks.append(asyncio.create_task(self.traffic(sim)))
+            # stagger the arrivals a little so every guild doesn't start on the same tick
+            await asyncio.sleep(0)
+
+    # function to sample how late the event loop wakes up from short sleeps
+    async def sampleLag(self, lags: list, until: float):
+        while time.perf_counter() < until:
+            start = time.perf_counter()
+            await asyncio.sleep(0.05)
+            lags.append(time.perf_counter() - start - 0.05)
+
+    async def runStage(self, count: int, metrics, scheduler, errorCounter: ErrorCounter) -> str:
+        await self.addGuilds(count)
+        gap_before = metrics.PLAYBACK_GAP.samples().get((), [[0] * (len(metrics.PLAYBACK_GAP.buckets) + 1), 0.0, 0])
+        plays, conflicts = FakeVoiceClient.plays, FakeVoiceClient.conflicts
+        sent, merged, dropped = scheduler.sent, scheduler.merged, scheduler.dropped
+        errors, busy, logged, commands = self.errors, self.busy, errorCounter.count, self.commands
+
+        lags = []
+        wall, cpu = time.perf_counter(), time.process_time()
+        await self.sampleLag(lags, wall + self.args.duration)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        gap_after = metrics.PLAYBACK_GAP.samples().get((), gap_before)
+        gaps = [[after - before for before, after in zip(gap_before[0], gap_after[0])], gap_after[1] - gap_before[1], gap_after[2] - gap_before[2]]
+        gap = f"avg {gaps[1] / gaps[2] * 1000:.1f}ms  p95 ≤{metrics.PLAYBACK_GAP.quantile(gaps, 0.95) * 1000:.0f}ms" if gaps[2] else "no tracks changed"
+        return "\n".join(
+            [
+                f"{count} guilds, {len(self.bot.voice_clients)} in voice, {self.commands - commands} commands",
+                f"  loop lag   p50 {percentile(lags, 0.5) * 1000:.1f}ms  p99 {percentile(lags, 0.99) * 1000:.1f}ms  max {max(lags, default=0) * 1000:.1f}ms",
+                f"  cpu        {cpu / wall:.0%}",
+                f"  rss        {residentMemory() / 2**20:.1f}MB",
+                f"  track gap  {gap}",
+                f"  tracks     {FakeVoiceClient.plays - plays} started, {FakeVoiceClient.conflicts - conflicts} rejected plays",
+                f"  messages   {scheduler.sent - sent} sent, {scheduler.merged - merged} merged, {scheduler.dropped - dropped} dropped",
+                f"  errors     {self.busy - busy} turned away busy, {self.errors - errors} commands failed, {errorCounter.count - logged} logged",
+            ]
+        )
+
+    async def stop(self):
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for voice_client in list(self.bot.voice_clients):
+            await voice_client.disconnect(force=True)
+
+
+async def run(args, report: io.StringIO):
+    installFakeYoutubeDL(args.latency, args.failure_rate, args.playlist, duration=args.track_seconds)
+    installFakeAudio(args.track_seconds)
+    # imported after the stand-ins are in place, the commands and controllers only ever see the fakes
+    import venusbot
+    from scripts import metrics, spotify
+    from scripts.message_scheduler import getMessageScheduler
+
+    client = FakeClient()
+    # the commands look the bot up as a module global, so swap in a fake client that shares VenusBot's controller handling
+    client.musicControllers = collections.OrderedDict()
+    client.snapshots = types.SimpleNamespace(pending={})
+    # every guild is busy for the whole run, so none of them should be let go of
+    client.controllerTTL = 3600
+    client.controllerLimit = 100000
+    for name in ("getGuildMusicController", "popGuildMusicController", "evictIdleControllers"):
+        setattr(client, name, types.MethodType(getattr(venusbot.VenusBot, name), client))
+    venusbot.bot = client
+    errorCounter = ErrorCounter()
+    logging.getLogger().addHandler(errorCounter)
+
+    audio = FakeAudioThread(client)
+    audio.start()
+    simulator = LoadSimulator(args, venusbot)
+    print(f"tracks {args.track_seconds}s, a command every {args.interval}s per guild, extraction latency {args.latency * 1000:.0f}ms\n", file=report)
+    try:
+        for count in args.guilds:
+            print(await simulator.runStage(count, metrics, getMessageScheduler(), errorCounter), file=report)
+    finally:
+        await simulator.stop()
+        audio.running = False
+        audio.join()
+        await spotify.closeSession()
+    print(f"\n{sum(len(controller.songQueue) for controller in client.musicControllers.values())} songs queued at the end", file=report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-guild load simulator for the music controllers.")
+    parser.add_argument("--guilds", type=lambda value: [int(count) for count in value.split(",")], default=[25, 50, 100], help="comma separated guild counts, one stage each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds each stage runs for")
+    parser.add_argument("--track-seconds", type=int, default=8, help="length of every fake song")
+    parser.add_argument("--interval", type=float, default=3, help="average seconds between commands in each guild")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds each fake yt-dlp extraction takes on average")
+    parser.add_argument("--failure-rate", type=float, default=0.01, help="share of fake extractions that fail")
+    parser.add_argument("--playlist", type=int, default=25, help="songs in each playlist queued with /play")
+    parser.add_argument("--channel-latency", type=float, default=0.05, help="seconds each fake discord message send takes")
+    args = parser.parse_args()
+
+    # keep the bot's logging out of bot_log.log and the report, errors are still counted
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    with tempfile.TemporaryDirectory() as directory:
+        # a throwaway metadata cache and snapshot file, so runs start cold and never touch the real ones
+        os.environ["METADATA_CACHE_PATH"] = os.path.join(directory, "metadata_cache.db")
+        os.environ["SNAPSHOT_PATH"] = os.path.join(directory, "queue_snapshots.json.gz")
+        # preload the next song a couple of seconds early, the fake songs are much shorter than real ones
+        os.environ.setdefault("GAPLESS_PRELOAD_SECONDS", "2")
+        # queueSong prints the queue on every add, keep that out of the report
+        report = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run(args, report))
+        print(report.getvalue(), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Drives determineSongSource -> handle* -> queueSong end to end against the stand-ins in benchmarks/fakes.py, so the
+# pipeline can be measured without YouTube, Spotify or Discord. Reports:
+#   /play latency      - p50/p99 of single searches, first with a cold metadata cache and then with a warm one
+#   playlist ingest    - tracks/sec for a YouTube playlist (flat, no per-song lookups) and a Spotify playlist (one search per song)
+#   memory per song    - bytes of queue growth per song queued from a large playlist
+#
+# usage: python -m benchmarks.offline_pipeline_benchmark [--latency 0.2] [--failure-rate 0.02] [--plays 200] [--playlist 300]
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeChannel, FakeClient, FakeGuild, FakeSpotify, FakeUser, installFakeYoutubeDL
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def makeController(MusicController):
+    text_channel = FakeChannel(2)
+    guild = FakeGuild(1, [text_channel])
+    controller = MusicController(client=FakeClient(), guild=guild)
+    controller.textChannel = text_channel
+    return controller
+
+
+# function to empty the queue and put a song in front as if it were playing, so everything queued after it just waits
+def resetQueue(controller, Song):
+    controller.songQueue.clear()
+    controller.songQueue.append(Song("Now Playing", "https://www.youtube.com/watch?v=nowplaying0", None, 200, 0))
+
+
+async def measurePlays(controller, user, queries: list) -> list:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        await controller.determineSongSource(user, query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def measureIngest(controller, user, url: str) -> tuple:
+    before = len(controller.songQueue)
+    start = time.perf_counter()
+    await controller.determineSongSource(user, url)
+    elapsed = time.perf_counter() - start
+    return len(controller.songQueue) - before, elapsed
+
+
+async def run(args, report: io.StringIO):
+    spotify = FakeSpotify(latency=args.spotify_latency, playlist_size=args.playlist)
+    await spotify.start()
+    installFakeYoutubeDL(args.latency, args.failure_rate, args.playlist)
+    # imported after the stand-ins are in place, the spotify controller reads its urls when it's created
+    from music_controller import MusicController, Song
+    from scripts import metrics
+
+    controller = makeController(MusicController)
+    user = FakeUser(1)
+    results = []
+
+    resetQueue(controller, Song)
+    queries = [f"benchmark song {i}" for i in range(args.plays)]
+    cold = await measurePlays(controller, user, queries)
+    warm = await measurePlays(controller, user, queries)
+    for name, latencies in (("/play cold", cold), ("/play warm", warm)):
+        results.append((name, f"p50 {percentile(latencies, 0.5) * 1000:.1f}ms  p99 {percentile(latencies, 0.99) * 1000:.1f}ms  mean {statistics.mean(latencies) * 1000:.1f}ms"))
+
+    resetQueue(controller, Song)
+    added, elapsed = await measureIngest(controller, user, "https://www.youtube.com/playlist?list=PLbenchmark")
+    results.append(("youtube playlist", f"{added} tracks in {elapsed:.2f}s, {added / elapsed:.0f} tracks/sec"))
+
+    resetQueue(controller, Song)
+    added, elapsed = await measureIngest(controller, user, "https://open.spotify.com/playlist/benchmark")
+    results.append(("spotify playlist", f"{added} tracks in {elapsed:.2f}s, {added / elapsed:.1f} tracks/sec ({spotify.requests} spotify requests)"))
+
+    # memory is measured on a big flat playlist, which is how most songs end up queued
+    installFakeYoutubeDL(0, 0, args.memory_songs)
+    resetQueue(controller, Song)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    added, _ = await measureIngest(controller, user, "https://www.youtube.com/playlist?list=PLmemory")
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    results.append(("memory per song", f"{used / max(1, added):.0f}B over {added} queued songs"))
+
+    print(f"extraction latency {args.latency * 1000:.0f}ms, failure rate {args.failure_rate:.0%}, spotify latency {args.spotify_latency * 1000:.0f}ms\n", file=report)
+    for name, value in results:
+        print(f"{name:<18}{value}", file=report)
+    print("\npipeline metrics", file=report)
+    for name, value in metrics.summary():
+        print(f"  {name}", file=report)
+        for line in value.splitlines():
+            print(f"    {line}", file=report)
+
+    # let the background prefetches and messages finish before tearing down
+    await asyncio.sleep(0.5)
+    await spotify.stop()
+    from scripts import spotify as spotify_module
+
+    await spotify_module.closeSession()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the song lookup and queueing pipeline.")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds each fake yt-dlp extraction takes on average")
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="share of fake extractions that fail")
+    parser.add_argument("--spotify-latency", type=float, default=0.02, help="seconds each fake spotify request takes")
+    parser.add_argument("--plays", type=int, default=200, help="single /play searches to time")
+    parser.add_argument("--playlist", type=int, default=300, help="songs in the benchmark playlists")
+    parser.add_argument("--memory-songs", type=int, default=20000, help="songs queued when measuring memory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # a throwaway metadata cache, so runs start cold and never touch the real one
+        os.environ["METADATA_CACHE_PATH"] = os.path.join(directory, "metadata_cache.db")
+        os.environ["SNAPSHOT_PATH"] = os.path.join(directory, "queue_snapshots.json.gz")
+        # queueSong prints the queue on every add, keep that out of the report
+        report = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run(args, report))
+        print(report.getvalue(), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Measures the CPU cost of one audio stream for each way MusicController can build a player:
+#   pcm          - FFmpegPCMAudio + PCMVolumeTransformer, opus encoded in python (the old path)
+#   opus-copy    - FFmpegOpusAudio passing an opus stream straight through (opus source, 100% volume)
+#   opus-encode  - FFmpegOpusAudio with ffmpeg doing the volume filter and the opus encode
+# Every frame is read as fast as possible, the way discord's audio player thread would read it, and the
+# CPU used by this process plus the ffmpeg child is divided by the length of the audio. The result is the
+# share of one core a single stream keeps busy while it plays.
+#
+# needs ffmpeg on PATH and libopus loadable by discord.py
+# usage: python -m benchmarks.playback_cpu_benchmark [seconds of audio]
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import discord
+
+from music_controller import MusicController, Song
+from scripts.link_store import getLinkStore
+
+
+def makeTestFile(directory: str, seconds: int) -> str:
+    # a stereo 48khz opus/webm file, the same shape as youtube's best audio format
+    path = os.path.join(directory, "benchmark.webm")
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-ac", "2", "-ar", "48000", "-c:a", "libopus", "-b:a", "160k", path],
+        check=True,
+    )
+    return path
+
+
+def childCpuTime() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(controller: MusicController, song: Song, seconds: int) -> float:
+    encoder = None
+    cpu_start = time.process_time()
+    child_start = childCpuTime()
+    source = controller.createAudioSource(song)
+    if not source.is_opus():
+        encoder = discord.opus.Encoder()
+    frames = 0
+    while data := source.read():
+        # this is the work discord's player does on every 20ms frame of a pcm source
+        if encoder is not None:
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    # cleanup waits for ffmpeg to exit, so its cpu time is counted
+    source.cleanup()
+    cpu = (time.process_time() - cpu_start) + (childCpuTime() - child_start)
+    if frames < seconds * 40:
+        print(f"warning: only read {frames} frames")
+    return cpu / seconds
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    discord.opus._load_default()
+    if not discord.opus.is_loaded():
+        sys.exit("libopus could not be loaded, it is needed to measure the pcm path")
+
+    controller = MusicController(client=None, guild="benchmark")
+    with tempfile.TemporaryDirectory() as directory:
+        path = makeTestFile(directory, seconds)
+        getLinkStore().put(path, path, "opus")
+        song = Song("Benchmark Song", path, None, seconds, None)
+        cases = [
+            ("pcm", "pcm", 1.0),
+            ("opus-copy", "opus", 1.0),
+            ("opus-encode", "opus", 0.5),
+        ]
+        results = {}
+        print(f"{seconds}s of audio per stream\n")
+        print(f"{'path':<14}{'cpu per stream':>16}")
+        for name, mode, volume in cases:
+            controller.playbackMode = mode
+            controller.volume = volume
+            results[name] = measure(controller, song, seconds)
+            print(f"{name:<14}{results[name] * 100:>15.2f}%")
+        print()
+        for name in ("opus-copy", "opus-encode"):
+            print(f"{name} uses {results[name] / results['pcm'] * 100:.0f}% of the pcm path's cpu")
+
+
+if __name__ == "__main__":
+    main()
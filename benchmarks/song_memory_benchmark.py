@@ -0,0 +1,116 @@
+# Measures how much memory queued songs take with the old Song (a __dict__ per song holding the discord.User,
+# the stream link and codec) against the compact one (slots, a user id, interned strings, links kept once per
+# video in the shared link store). The queues are built the way the bot fills them: many guilds, a pool of
+# popular videos that show up in more than one guild, every lookup handing back fresh copies of the strings,
+# and half the songs queued with /play (which comes with a stream link) and half from playlists (which doesn't).
+#
+# usage: python -m benchmarks.song_memory_benchmark [songs] [guilds]
+import gc
+import random
+import sys
+import tracemalloc
+
+from music_controller import Song
+from scripts.link_store import StreamLinkStore
+from scripts.song_queue import SongQueue
+
+
+class LegacySong:
+    def __init__(self, title, url, link, thumbnail, duration, user, codec=None):
+        self.title = title
+        self.url = url
+        self.link = link
+        self.thumbnail = thumbnail
+        self.duration = duration
+        self.user = user
+        self.codec = codec
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+
+
+def fresh(value: str) -> str:
+    # yt-dlp builds new strings for every lookup, so songs never share them by accident
+    return (value + " ")[:-1]
+
+
+def makeVideos(count: int) -> list:
+    videos = []
+    for i in range(count):
+        video_id = f"{i:011d}"
+        link = f"https://rr{i % 9}---sn-abcdefg.googlevideo.com/videoplayback?expire=9999999999&ei=abcdefghijk&ip=127.0.0.1&id=o-{'A' * 40}&itag=251&source=youtube&mime=audio%2Fwebm&dur=213.000&lmt=1700000000000000&sig={'B' * 120}&lsig={'C' * 90}"
+        videos.append(
+            {
+                "title": f"Artist {i % 500} - Song Title Number {i} Official Audio",
+                "url": f"https://www.youtube.com/watch?v={video_id}",
+                "thumbnail": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg?sqp=-oaymwEcCNACELwBSFXyq4qpAw4IARUAAIhCGAFwAcABBg==&rs=AOn4CLC{'D' * 30}",
+                "duration": 180 + i % 120,
+                "link": link,
+            }
+        )
+    return videos
+
+
+def plan(songs: int, guilds: int, videos: list) -> list:
+    # (guild, video, user, queued with /play) for every song, the same plan is used for both layouts
+    rng = random.Random(0)
+    popular = videos[: len(videos) // 10]
+    entries = []
+    for i in range(songs):
+        video = rng.choice(popular) if rng.random() < 0.3 else rng.choice(videos)
+        entries.append((i % guilds, video, rng.randrange(guilds * 5), rng.random() < 0.5))
+    return entries
+
+
+def buildLegacy(entries: list, guilds: int) -> list:
+    users = {}
+    queues = [SongQueue() for _ in range(guilds)]
+    for guild, video, user_id, played in entries:
+        user = users.setdefault(user_id, FakeUser(user_id))
+        link = fresh(video["link"]) if played else None
+        queues[guild].append(LegacySong(fresh(video["title"]), fresh(video["url"]), link, fresh(video["thumbnail"]), video["duration"], user, "opus" if played else None))
+    return queues
+
+
+def buildCompact(entries: list, guilds: int) -> list:
+    store = StreamLinkStore()
+    queues = [SongQueue() for _ in range(guilds)]
+    for guild, video, user_id, played in entries:
+        url = fresh(video["url"])
+        if played:
+            store.put(url, fresh(video["link"]), "opus")
+        queues[guild].append(Song(fresh(video["title"]), url, fresh(video["thumbnail"]), video["duration"], user_id))
+    return queues, store
+
+
+def measure(build, *args) -> int:
+    gc.collect()
+    tracemalloc.start()
+    result = build(*args)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return used
+
+
+def main():
+    songs = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    guilds = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    videos = makeVideos(max(1, songs // 10))
+    entries = plan(songs, guilds, videos)
+
+    legacy = measure(buildLegacy, entries, guilds)
+    compact = measure(buildCompact, entries, guilds)
+    print(f"{songs} queued songs across {guilds} guilds, {len(videos)} distinct videos\n")
+    print(f"{'layout':<10}{'total':>12}{'per song':>12}")
+    print(f"{'legacy':<10}{legacy / 2**20:>10.1f}MB{legacy / songs:>11.0f}B")
+    print(f"{'compact':<10}{compact / 2**20:>10.1f}MB{compact / songs:>11.0f}B")
+    print(f"\ncompact songs use {compact / legacy * 100:.0f}% of the legacy memory")
+
+
+if __name__ == "__main__":
+    main()
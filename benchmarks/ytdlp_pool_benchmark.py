@@ -0,0 +1,64 @@
+# Measures the per-call cost of building a fresh YoutubeDL (the old behaviour) against reusing the
+# warm per-thread instance from scripts.ytDLP.getYoutubeDL. No network is used: every call runs
+# format selection on a canned info dict, so the difference is purely yt-dlp setup overhead.
+#
+# usage: python -m benchmarks.ytdlp_pool_benchmark [calls]
+import sys
+import time
+from pathlib import Path
+
+from yt_dlp import YoutubeDL
+
+from scripts.ytDLP import PROFILES, getYoutubeDL
+
+COOKIES_PATH = Path(__file__).resolve().parent.parent / "cookies.txt"
+
+# a video result shaped like what the youtube extractor hands back, with a handful of formats to pick from
+FAKE_INFO = {
+    "_type": "video",
+    "id": "dQw4w9WgXcQ",
+    "title": "Benchmark Song",
+    "duration": 213,
+    "webpage_url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "extractor": "youtube",
+    "extractor_key": "Youtube",
+    "formats": [
+        {"format_id": "249", "url": "https://example.invalid/249?expire=9999999999", "ext": "webm", "acodec": "opus", "vcodec": "none", "abr": 50},
+        {"format_id": "250", "url": "https://example.invalid/250?expire=9999999999", "ext": "webm", "acodec": "opus", "vcodec": "none", "abr": 70},
+        {"format_id": "251", "url": "https://example.invalid/251?expire=9999999999", "ext": "webm", "acodec": "opus", "vcodec": "none", "abr": 160},
+        {"format_id": "140", "url": "https://example.invalid/140?expire=9999999999", "ext": "m4a", "acodec": "mp4a.40.2", "vcodec": "none", "abr": 128},
+        {"format_id": "18", "url": "https://example.invalid/18?expire=9999999999", "ext": "mp4", "acodec": "mp4a.40.2", "vcodec": "avc1", "height": 360},
+    ],
+}
+
+
+def freshInstance(profile):
+    with YoutubeDL({**PROFILES[profile], "cookies": COOKIES_PATH, "quiet": True}) as ytdlp:
+        return ytdlp.process_ie_result(dict(FAKE_INFO), download=False)
+
+
+def pooledInstance(profile):
+    return getYoutubeDL(profile, COOKIES_PATH).process_ie_result(dict(FAKE_INFO), download=False)
+
+
+def timeCalls(func, profile, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func(profile)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # make the pooled profiles quiet too, so both sides do the same work
+    for options in PROFILES.values():
+        options["quiet"] = True
+    print(f"{'profile':<14}{'fresh (ms)':>12}{'pooled (ms)':>13}{'saved (ms)':>12}{'speedup':>9}")
+    for profile in PROFILES:
+        fresh = timeCalls(freshInstance, profile, calls)
+        pooled = timeCalls(pooledInstance, profile, calls)
+        print(f"{profile:<14}{fresh * 1000:>12.3f}{pooled * 1000:>13.3f}{(fresh - pooled) * 1000:>12.3f}{fresh / pooled:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
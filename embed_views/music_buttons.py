@@ -2,14 +2,17 @@ import discord
 
 
 class MusicButtons(discord.ui.View):
-    def __init__(self, client, musicController):
+    # the view lives as long as the bot does, so it only keeps the client and looks the guild's controller up on every
+    # click, holding on to the controller would keep it alive after it's let go of
+    def __init__(self, client):
         super().__init__(timeout=None)
+        self.client = client
         self.tree = client.tree
-        self.musicController = musicController
 
     @discord.ui.button(label="⏸️", style=discord.ButtonStyle.secondary, row=0)
     async def PauseResume_Button(self, interaction: discord.Interaction, Button: discord.ui.Button):
-        response = await self.musicController.pauseSong()
+        musicController = await self.client.getGuildMusicController(interaction.guild)
+        response = await musicController.pauseSong()
         if response:
             Button.label = "▶️"
             await interaction.response.edit_message(view=self)
@@ -2,32 +2,68 @@ import math
 
 import discord
 
+from music_controller import formatDuration
+
+PAGE_SIZE = 25
+# how many search matches are listed, the view jumps to the first one
+SEARCH_RESULTS = 10
+
 
 class QueueView(discord.ui.View):
-    def __init__(self, queue, bot, author, timeout=60):
+    def __init__(self, queue, bot, author, musicController=None, timeout=60):
         super().__init__(timeout=timeout)
         self.queue = queue
+        # used for when each song will play, the page is shown without times if it's missing
+        self.musicController = musicController
         self.bot = bot
         self.author = author
         self.page = 0
-        self.max_pages = math.ceil((len(self.queue) - 1) / 25)
         self.selected_song_index = None
+        self.selected_song = None
         self.queueMessage = None
         self.removeMessage = None
         self.moveMessage = None
 
+    # the queue keeps changing while the view is open, so the page count is worked out from its current length
+    @property
+    def max_pages(self) -> int:
+        return max(1, math.ceil((len(self.queue) - 1) / PAGE_SIZE))
+
+    # function to get the queue position of the first song on the current page
+    def page_start(self) -> int:
+        return self.page * PAGE_SIZE + 1
+
+    # function to get (position, song) for the songs on the current page, slicing the queue only walks this page
+    def page_songs(self) -> list:
+        start = self.page_start()
+        return list(enumerate(self.queue[start : start + PAGE_SIZE], start=start))
+
+    # function to find where a song picked from an older render of the page is now, None if it has left the queue
+    def locate_song(self, song, position: int):
+        try:
+            return self.queue.indexOf(song, position)
+        except ValueError:
+            return None
+
     async def send_page(self, interaction: discord.Interaction, first_response=False):
-        start = self.page * 25 + 1
-        end = start + 25
-        songs = self.queue[start:end]
+        # songs finishing or being removed can leave the view past the last page
+        self.page = min(self.page, self.max_pages - 1)
 
         embed = discord.Embed(
             title=f"Queue (Page {self.page + 1}/{self.max_pages})",
             color=0xA600FF,
         )
         embed.set_thumbnail(url=self.bot.user.avatar.url)
-        for i, song in enumerate(songs, start=start):
-            embed.add_field(name=f"{i}", value=song.title, inline=False)
+        page_songs = self.page_songs()
+        # only the first song's start time needs the queue's duration index, the rest of the page adds up from it
+        plays_in = self.musicController.timeUntil(page_songs[0][0]) if self.musicController and page_songs else None
+        for i, song in page_songs:
+            value = song.title if plays_in is None else f"{song.title}\nPlays in {formatDuration(plays_in)}"
+            embed.add_field(name=f"{i}", value=value, inline=False)
+            if plays_in is not None:
+                plays_in += song.duration or 0
+        if self.musicController:
+            embed.set_footer(text=f"Queue length: {formatDuration(self.musicController.remainingTime())}")
 
         if first_response:
             self.queueMessage = await interaction.response.send_message(embed=embed, view=self, ephemeral=True)
@@ -61,9 +97,8 @@ class QueueView(discord.ui.View):
             await interaction.response.send_message("You can't control this queue.", ephemeral=True)
             return
 
-        start = self.page * 25 + 1
-        end = start + 25
-        options = [discord.SelectOption(label=song.title, value=str(i)) for i, song in enumerate(self.queue[start:end], start=start)]
+        page_songs = dict(self.page_songs())
+        options = [discord.SelectOption(label=song.title[:100], value=str(i)) for i, song in page_songs.items()]
 
         class RemoveDropdown(discord.ui.Select):
             def __init__(self, parent_view):
@@ -71,7 +106,12 @@ class QueueView(discord.ui.View):
                 super().__init__(placeholder="Select a song to remove...", options=options)
 
             async def callback(self, select_interaction: discord.Interaction):
-                index = int(self.values[0])
+                # songs may have finished since the dropdown was made, so the pick is found again by the song itself
+                index = self.parent_view.locate_song(page_songs[int(self.values[0])], int(self.values[0]))
+                if not index:
+                    message = "That song is no longer in the queue." if index is None else "That song is playing now."
+                    await select_interaction.response.send_message(message, ephemeral=True)
+                    return
                 removed_song = self.parent_view.queue.pop(index)
                 await self.parent_view.removeMessage.resource.delete()
                 await select_interaction.response.send_message(f"Removed: {removed_song.title}", ephemeral=True)
@@ -87,11 +127,8 @@ class QueueView(discord.ui.View):
             await interaction.response.send_message("You can't control this queue.", ephemeral=True)
             return
 
-        start = self.page * 25 + 1
-        end = start + 25
-        current_songs = self.queue[start:end]
-
-        options = [discord.SelectOption(label=song.title, value=str(i)) for i, song in enumerate(current_songs, start=start)]
+        page_songs = dict(self.page_songs())
+        options = [discord.SelectOption(label=song.title[:100], value=str(i)) for i, song in page_songs.items()]
 
         class SelectSongToMove(discord.ui.Select):
             def __init__(self, parent_view):
@@ -100,12 +137,13 @@ class QueueView(discord.ui.View):
 
             async def callback(self, select_interaction: discord.Interaction):
                 self.parent_view.selected_song_index = int(self.values[0])
+                self.parent_view.selected_song = page_songs[self.parent_view.selected_song_index]
 
                 class MoveToModal(discord.ui.Modal, title="Move Song To Position"):
                     def __init__(self, parent_view):
                         super().__init__()
                         self.parent_view = parent_view
-                        self.position_input = discord.ui.TextInput(label="Enter the new position:", style=discord.TextStyle.short, required=True, max_length=3)
+                        self.position_input = discord.ui.TextInput(label="Enter the new position:", style=discord.TextStyle.short, required=True, max_length=6)
                         self.add_item(self.position_input)
 
                     async def on_submit(self, modal_interaction: discord.Interaction):
@@ -113,10 +151,11 @@ class QueueView(discord.ui.View):
                             new_index = int(self.position_input.value)
                             if new_index < 1 or new_index >= len(self.parent_view.queue):
                                 raise ValueError("Invalid position: out of bounds or cannot move to index 0.")
-                            from_index = self.parent_view.selected_song_index
+                            from_index = self.parent_view.locate_song(self.parent_view.selected_song, self.parent_view.selected_song_index)
+                            if not from_index:
+                                raise ValueError("That song is no longer waiting in the queue.")
 
-                            song = self.parent_view.queue.pop(from_index)
-                            self.parent_view.queue.insert(new_index, song)
+                            self.parent_view.queue.move(from_index, new_index)
                             await modal_interaction.response.send_message(f"Moved song to position {new_index}.", ephemeral=True)
                             await self.parent_view.send_page(interaction)
                             await self.parent_view.moveMessage.resource.delete()
@@ -140,3 +179,55 @@ class QueueView(discord.ui.View):
             await self.send_page(interaction)
         else:
             await interaction.response.send_message("No more pages left.", ephemeral=True)
+
+    @discord.ui.button(label="Jump to Page", style=discord.ButtonStyle.secondary, row=1)
+    async def jump_to_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if interaction.user.id != self.author.id:
+            await interaction.response.send_message("You can't control this queue.", ephemeral=True)
+            return
+
+        class JumpToModal(discord.ui.Modal, title="Jump To Page"):
+            def __init__(self, parent_view):
+                super().__init__()
+                self.parent_view = parent_view
+                self.page_input = discord.ui.TextInput(label=f"Enter a page (1-{parent_view.max_pages}):", style=discord.TextStyle.short, required=True, max_length=6)
+                self.add_item(self.page_input)
+
+            async def on_submit(self, modal_interaction: discord.Interaction):
+                try:
+                    page = int(self.page_input.value)
+                    if page < 1 or page > self.parent_view.max_pages:
+                        raise ValueError(f"Invalid page: there are {self.parent_view.max_pages} pages.")
+                    self.parent_view.page = page - 1
+                    await modal_interaction.response.send_message(f"Now viewing Page {page}.", ephemeral=True, delete_after=2)
+                    await self.parent_view.send_page(interaction)
+                except Exception as e:
+                    await modal_interaction.response.send_message(f"Error: {e}", ephemeral=True)
+
+        await interaction.response.send_modal(JumpToModal(self))
+
+    @discord.ui.button(label="Search", style=discord.ButtonStyle.primary, row=1)
+    async def search(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if interaction.user.id != self.author.id:
+            await interaction.response.send_message("You can't control this queue.", ephemeral=True)
+            return
+
+        class SearchModal(discord.ui.Modal, title="Search The Queue"):
+            def __init__(self, parent_view):
+                super().__init__()
+                self.parent_view = parent_view
+                self.title_input = discord.ui.TextInput(label="Enter part of a song title:", style=discord.TextStyle.short, required=True, max_length=100)
+                self.add_item(self.title_input)
+
+            async def on_submit(self, modal_interaction: discord.Interaction):
+                # the song playing now isn't on any page, so it's left out of the matches
+                matches = [(i, song) for i, song in self.parent_view.queue.search(self.title_input.value, SEARCH_RESULTS + 1) if i > 0][:SEARCH_RESULTS]
+                if not matches:
+                    await modal_interaction.response.send_message(f"No songs in the queue match '{self.title_input.value}'.", ephemeral=True)
+                    return
+                self.parent_view.page = (matches[0][0] - 1) // PAGE_SIZE
+                lines = "\n".join(f"{i}. {song.title}" for i, song in matches)
+                await modal_interaction.response.send_message(f"Matches in the queue:\n{lines}", ephemeral=True)
+                await self.parent_view.send_page(interaction)
+
+        await interaction.response.send_modal(SearchModal(self))
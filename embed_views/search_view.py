@@ -2,10 +2,11 @@ import discord
 
 
 class SearchView(discord.ui.View):
-    def __init__(self, songs, musicController, bot):
+    # like MusicButtons the view never times out, so the guild's controller is looked up when a song is picked
+    # instead of being kept here
+    def __init__(self, songs, bot):
         super().__init__(timeout=None)
         self.songs = songs
-        self.musicController = musicController
         self.bot = bot
 
     async def send_page(self, interaction: discord.Interaction):
@@ -26,18 +27,19 @@ class SearchView(discord.ui.View):
             async def callback(self, interaction: discord.Interaction):
                 index = int(self.values[0])
                 song = self.parent_view.songs[index]
+                musicController = await self.parent_view.bot.getGuildMusicController(interaction.guild)
 
                 # check if bot is connected to a voice channel
-                if not self.parent_view.musicController.isConnectedToVC():
+                if not musicController.isConnectedToVC():
                     # check if user is in a voice channel
                     if not interaction.user.voice or not interaction.user.voice.channel:
                         await interaction.response.send_message("You or the Bot must be in a voice channel to use this command.")
                         return
                     else:
-                        await self.parent_view.musicController.two_four_seven(interaction.user.voice.channel, interaction.channel)
+                        await musicController.two_four_seven(interaction.user.voice.channel, interaction.channel)
 
                 await interaction.response.send_message(f"Adding **{song['title']}**", delete_after=5)
-                await self.parent_view.musicController.determineSongSource(interaction.user, song["link"])
+                await musicController.determineSongSource(interaction.user, song["link"])
 
         dropdown_view = discord.ui.View()
         dropdown_view.add_item(SongDropdown(self))
@@ -1,25 +1,68 @@
 import asyncio
+import collections
 import logging
-import random
-import re
+import os
+import sys
 import time
 from typing import Tuple
 
 import discord
 
 from embed_views.music_buttons import MusicButtons
-from scripts.spotify import SpotifyController
-from scripts.ytDLP import VideoSearcher, getSongExpiration
+from scripts.bulk_add_notifier import BulkAddNotifier
+from scripts.extraction_scheduler import BULK, PREFETCH, REFRESH
+from scripts.link_refresher import getLinkRefresher
+from scripts.link_store import getLinkStore
+from scripts.message_scheduler import HIGH, LOW, NORMAL, getMessageScheduler
+from scripts.metrics import FFMPEG_SPAWN, PLAYBACK_GAP
+from scripts.resolvers import canonicalId, matchSource
+from scripts.song_queue import SongQueue
+from scripts.spotify import getSpotifyController
+from scripts.title_index import getTitleIndex
+from scripts.ytDLP import VideoSearcher
+
+
+# function to share one copy of strings that many queued songs repeat, like the same title queued in many guilds
+def intern(value: str | None) -> str | None:
+    return sys.intern(value) if value else value
+
+
+# function to turn seconds into m:ss, or h:mm:ss for an hour or more
+def formatDuration(seconds: int) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+# function to combine "Added to Queue" embeds that are still waiting to be sent into one
+def mergeAddedToQueue(waiting: dict, new: dict) -> dict:
+    embed = waiting["embed"]
+    count = int(embed.footer.text.split()[0]) if embed.footer.text else 1
+    title = new["embed"].description
+    # embed descriptions are capped at 4096 characters, past that only the count keeps going up
+    if len(embed.description) + len(title) < 4000:
+        embed.description += f"\n{title}"
+    embed.set_footer(text=f"{count + 1} songs added")
+    # the first song added still plays first, but the queue length is whatever the newest embed says
+    for field in new["embed"].fields:
+        if field.name == "Queue Length":
+            embed.set_field_at(len(embed.fields) - 1, name=field.name, value=field.value, inline=field.inline)
+    embed.set_thumbnail(url=new["embed"].thumbnail.url)
+    return {**new, "embed": embed}
 
 
 class Song:
-    def __init__(self, title: str, url: str, link: str, thumbnail: str, duration: int, user: discord.User):
-        self.title = title
-        self.url = url
-        self.link = link
-        self.thumbnail = thumbnail
+    # a guild can have thousands of songs queued, so songs skip the per-object __dict__
+    # the stream link and its codec live in the shared link store, see scripts/link_store.py
+    __slots__ = ("title", "url", "thumbnail", "duration", "userId")
+
+    def __init__(self, title: str, url: str, thumbnail: str, duration: int, userId: int | None):
+        self.title = intern(title)
+        self.url = intern(url)
+        self.thumbnail = intern(thumbnail)
         self.duration = duration
-        self.user = user
+        # id of the user who queued the song, a discord.User would keep the whole user object alive
+        self.userId = userId
 
 
 class MusicController:
@@ -28,16 +71,40 @@ class MusicController:
         logging.info(f"Created Music Controller for: {guild}")
         self.client = client
         self.guild = guild
-        self.spotify = SpotifyController()
+        self.spotify = getSpotifyController()
+        self.links = getLinkStore()
+        self.titles = getTitleIndex()
+        self.refresher = getLinkRefresher()
+        self.outbox = getMessageScheduler()
         # self.loop = asyncio.get_running_loop() # apparently not necessary, use self.client.loop
         self.voiceChannel = None
         self.textChannel = None
-        self.songQueue = []
+        self.songQueue = SongQueue()
         self.isLooping = False
         self.start_time = None
         self.pause_start = None
         self.pause_duration = 0
         self.volume = 1.0
+        # how many playlist entries this guild may extract at once
+        self.extractionLimit = max(1, int(os.getenv("GUILD_EXTRACTION_LIMIT", 4)))
+        # shared by every playlist import in this guild, so two imports at once still stay under the limit together
+        self.extractionSemaphore = asyncio.Semaphore(self.extractionLimit)
+        # how many upcoming songs get their stream link fetched ahead of time
+        self.prefetchCount = max(0, int(os.getenv("PREFETCH_WINDOW", 2)))
+        # canonical id -> the stream link lookup running for it, copies of the same song share one lookup
+        self.resolvingSongs = {}
+        # the next song's ffmpeg source, opened shortly before the current song ends so the switch is instant
+        self.preloadSeconds = max(0, int(os.getenv("GAPLESS_PRELOAD_SECONDS", 10)))
+        self.nextUp = None
+        self.nextUpTimer = None
+        # "opus" hands opus to discord straight from ffmpeg, "pcm" is the old decode + python volume + re-encode path
+        self.playbackMode = os.getenv("PLAYBACK_MODE", "opus").lower()
+        # set when restored from a snapshot of a run where the bot was in its voice channel
+        self.wasConnected = False
+        # when the last song ended, to measure the silence before the next one starts
+        self.songEndedAt = None
+        # when a command last needed this controller, idle controllers are let go of some time after
+        self.lastUsed = time.monotonic()
 
     # function to check if the bot is currently connected to a voice channel
     def isConnectedToVC(self):
@@ -49,12 +116,20 @@ class MusicController:
             logging.debug(f"{self.guild.name} Music Controller is not connected to any voice channel.")
             return False
 
+    # function to check if the controller has nothing going on, so the bot can let go of it
+    def isIdle(self) -> bool:
+        return not self.songQueue and not self.resolvingSongs and self.nextUp is None and not self.isConnectedToVC()
+
+    # function to send a message to the text channel through the outbound message scheduler, it's sent in the background
+    def sendMessage(self, priority: int = NORMAL, mergeKey: str = None, merge=None, **kwargs) -> asyncio.Future:
+        return self.outbox.send(self.textChannel, priority, mergeKey, merge, **kwargs)
+
     # function to get the voice and text channel
     def getVideoAndTextChannel(self) -> Tuple[discord.VoiceChannel, discord.TextChannel]:
         return self.voiceChannel, self.textChannel
 
     # function to get the song queue
-    def getSongQueue(self) -> list:
+    def getSongQueue(self) -> SongQueue:
         return self.songQueue
 
     # function to set the volume
@@ -64,7 +139,14 @@ class MusicController:
         # Check if a song is currently playing and adjust the volume
         voice_client = discord.utils.get(self.client.voice_clients, guild=self.guild)
         if voice_client and voice_client.source:
-            voice_client.source.volume = self.volume
+            if isinstance(voice_client.source, discord.PCMVolumeTransformer):
+                voice_client.source.volume = self.volume
+            elif self.songQueue:
+                # ffmpeg applies the volume in opus mode, so restart it where the song currently is
+                self.restartCurrentSong(voice_client)
+        # the prepared next song was opened at the old volume
+        if self.nextUp is not None:
+            self.scheduleNextUp()
         return self.volume
 
     # function to set looping
@@ -79,13 +161,10 @@ class MusicController:
         if self.isConnectedToVC():
             if len(self.songQueue) <= 1:
                 return
-            # Preserve the first song
-            first_song = self.songQueue[0]
-            rest = self.songQueue[1:]
-            # Shuffle the remaining songs
-            random.shuffle(rest)
-            # Reassign the shuffled list back to the queue
-            self.songQueue[:] = [first_song] + rest
+            # Shuffle everything but the song that is playing
+            self.songQueue.shuffleTail()
+            # the song that was getting ready to play next probably isn't next anymore
+            self.scheduleNextUp()
         return
 
     async def searchSongs(self, query: str):
@@ -96,11 +175,11 @@ class MusicController:
             result = await searcher.getSearchResults(query)
         except Exception as e:
             logging.error(e)
-            await self.textChannel.send(f"Unable to search for songs: {e}")
+            self.sendMessage(content=f"Unable to search for songs: {e}")
             return
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to search for songs: unknown error")
+            self.sendMessage(content="Unable to search for songs: unknown error")
             return
         return result
 
@@ -124,6 +203,7 @@ class MusicController:
             else:
                 voice_client.resume()
                 self.pause_duration += int(time.time()) - self.pause_start
+                self.pause_start = None
                 return False
 
     # function to resume current song
@@ -134,6 +214,7 @@ class MusicController:
             if voice_client.is_paused():
                 voice_client.resume()
                 self.pause_duration += int(time.time()) - self.pause_start
+                self.pause_start = None
         return
 
     # function to stop all songs
@@ -141,7 +222,8 @@ class MusicController:
         logging.debug("Starting /stop function")
         if self.isConnectedToVC():
             voice_client = discord.utils.get(self.client.voice_clients, guild=self.guild)
-            self.songQueue = []
+            self.songQueue.clear()
+            self.discardNextUp()
             self.isLooping = False
             voice_client.stop()
             return
@@ -150,7 +232,8 @@ class MusicController:
     async def softDisconnect(self):
         if self.isConnectedToVC() is True:
             voice_client = discord.utils.get(self.client.voice_clients, guild=self.guild)
-            self.songQueue = []
+            self.songQueue.clear()
+            self.discardNextUp()
             self.isLooping = False
             await voice_client.disconnect(force=False)
             logging.debug(f"{self.guild.name} Music Controller has been soft disconnected.")
@@ -159,7 +242,8 @@ class MusicController:
     async def hardDisconnect(self):
         if self.isConnectedToVC() is True:
             voice_client = discord.utils.get(self.client.voice_clients, guild=self.guild)
-            self.songQueue = []
+            self.songQueue.clear()
+            self.discardNextUp()
             self.isLooping = False
             await voice_client.disconnect(force=True)
             logging.debug(f"{self.guild.name} Music Controller has been hard disconnected.")
@@ -179,40 +263,93 @@ class MusicController:
             logging.debug(f"Bot is already in channel: {voice_client.channel.name}")
             return voice_client
 
+    # function to sum up the state a snapshot holds, it changes whenever the snapshot would, None if there's nothing to keep
+    def snapshotSignature(self) -> tuple | None:
+        if self.voiceChannel is None or self.textChannel is None:
+            return None
+        return (self.songQueue.version, self.isLooping, self.volume, self.voiceChannel.id, self.textChannel.id, self.isConnectedToVC())
+
+    # function to turn the controller's state into something json can store, stream links are left out since they expire
+    def toSnapshot(self) -> dict:
+        return {
+            "voice": self.voiceChannel.id,
+            "text": self.textChannel.id,
+            "connected": self.isConnectedToVC(),
+            "loop": self.isLooping,
+            "volume": self.volume,
+            "songs": [[song.title, song.url, song.thumbnail, song.duration, song.userId] for song in self.songQueue],
+        }
+
+    # function to put back the state from a snapshot of the last run, nothing is extracted until a song is about to play
+    def restoreSnapshot(self, snapshot: dict):
+        self.voiceChannel = self.guild.get_channel(snapshot["voice"])
+        self.textChannel = self.guild.get_channel(snapshot["text"])
+        if self.voiceChannel is None or self.textChannel is None:
+            logging.info(f"{self.guild.name} channels from the snapshot are gone, not restoring it")
+            self.voiceChannel = self.textChannel = None
+            return
+        self.isLooping = snapshot["loop"]
+        self.volume = snapshot["volume"]
+        self.wasConnected = snapshot["connected"]
+        self.songQueue = SongQueue(Song(*fields) for fields in snapshot["songs"])
+        logging.info(f"Restored {len(self.songQueue)} songs for {self.guild.name} from the snapshot")
+
+    # function to rejoin the 24/7 channel after a restart and carry on with the restored queue
+    async def rejoinAfterRestart(self):
+        if not self.wasConnected or self.voiceChannel is None:
+            return
+        self.wasConnected = False
+        if not any(not member.bot for member in self.voiceChannel.members):
+            # everyone left while the bot was down, so drop the queue like a soft disconnect would
+            self.songQueue.clear()
+            return
+        await self.two_four_seven(self.voiceChannel, self.textChannel)
+        voice_client = discord.utils.get(self.client.voice_clients, guild=self.guild)
+        if self.songQueue and voice_client and not (voice_client.is_playing() or voice_client.is_paused()):
+            await self.playSong()
+
+    # function to resolve playlist entries concurrently, while still handing them back in playlist order
+    async def resolveInOrder(self, entries: list, resolve):
+        # the limit across every guild is enforced by the bulk class of the extraction scheduler
+        async def limitedResolve(entry):
+            async with self.extractionSemaphore:
+                return await resolve(entry)
+
+        # only keep a small window of lookups in flight, so a huge playlist doesn't spawn thousands of tasks
+        window = self.extractionLimit * 2
+        remaining = iter(entries)
+        pending = collections.deque()
+        for entry in remaining:
+            pending.append((entry, asyncio.create_task(limitedResolve(entry))))
+            if len(pending) >= window:
+                break
+        try:
+            while pending:
+                entry, task = pending.popleft()
+                try:
+                    result, error = await task, None
+                except Exception as e:
+                    result, error = None, e
+                # top the window back up before handing the result over
+                nextEntry = next(remaining, None)
+                if nextEntry is not None:
+                    pending.append((nextEntry, asyncio.create_task(limitedResolve(nextEntry))))
+                yield entry, result, error
+        finally:
+            # stop any lookups that are still running if the caller bails out early
+            for _, task in pending:
+                task.cancel()
+
     async def determineSongSource(self, user: discord.User, query: str):
         logging.debug("In Determine Song Source")
-        query_lower = query.lower()
-
-        # Regex patterns
-        youtube_pattern = re.compile(r"(https?://)?(www\.)?(youtube\.com|youtu\.be)/")
-        youtube_playlist_pattern = re.compile(r"(https?://)?(www\.)?(youtube\.com|youtu\.be)/playlist\?list=[\w-]+")
-        spotify_pattern = re.compile(r"(https?://)?(open\.)?spotify\.com/")
-        spotify_playlist_pattern = re.compile(r"(https?://)?(open\.)?spotify\.com/(playlist|album)/[a-zA-Z0-9]+")
-        soundcloud_pattern = re.compile(r"(https?://)?(www\.)?soundcloud\.com/")
-        soundcloud_playlist_pattern = re.compile(r"^(https?://)?(www\.)?soundcloud\.com/[^/]+/sets/[^/]+/?")
-
-        # Determine source
-        if youtube_pattern.search(query_lower):
-            logging.debug("Detected YouTube link")
-            if youtube_playlist_pattern.search(query_lower):
-                logging.debug("Detected YouTube playlist")
-                return await self.handleYoutubePlaylist(user, query)
-            return await self.handleYoutubeLink(user, query)
-        elif spotify_pattern.search(query_lower):
-            logging.debug("Detected Spotify link")
-            if spotify_playlist_pattern.search(query_lower):
-                logging.debug("Detected spotify playlist/album")
-                return await self.handleSpotifyPlaylist(user, query)
-            return await self.handleSpotifyLink(user, query)
-        elif soundcloud_pattern.search(query_lower):
-            logging.debug("Detected SoundCloud link")
-            if soundcloud_playlist_pattern.search(query_lower):
-                logging.debug("Detected SoundCloud playlist")
-                return await self.handleSoundCloudPlaylist(user, query)
-            return await self.handleSoundCloudLink(user, query)
-        else:
+        # the registry knows every source's links, anything it doesn't recognize is searched for on youtube
+        source = matchSource(query)
+        if source is None:
             logging.debug("Detected search query - assuming YouTube search")
             return await self.handleYoutubeSearch(user, query)
+        logging.debug(f"Detected {source.resolver.name} {source.kind}: {source.id}")
+        # handlers get the cleaned up link, so every form of the same song ends up with the same url
+        return await getattr(self, source.handler())(user, source.url)
 
     async def handleYoutubeLink(self, user, url):
         logging.debug("In handleYoutubeLink")
@@ -222,14 +359,14 @@ class MusicController:
             result = await searcher.getVideoInfoFromURL(url)
         except Exception as e:
             logging.error(e)
-            await self.textChannel.send(f"Unable to add song: {e}")
+            self.sendMessage(content=f"Unable to add song: {e}")
             return
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to find song.")
+            self.sendMessage(content="Unable to find song.")
             return
         # create a song object
-        youtubeSong = Song(result["title"], url, result["link"], result["thumbnail"], result["duration"], user)
+        youtubeSong = self.createSong(result, url, user)
         # queue the song
         await self.queueSong(youtubeSong)
         return
@@ -241,7 +378,7 @@ class MusicController:
         result = await searcher.getPlaylistInfo(url)
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to find playlist.")
+            self.sendMessage(content="Unable to find playlist.")
             return
         # get the playlist name and the number of songs
         metadata = result.pop(0)
@@ -254,20 +391,16 @@ class MusicController:
         embed.set_thumbnail(url=thumbnail)
         embed.add_field(name="Playlist Name", value=metadata["playlist_name"], inline=False)
         embed.add_field(name="# of Songs", value=metadata["song_count"], inline=False)
-        await self.textChannel.send(embed=embed)
+        # one embed is kept up to date with the progress instead of announcing every song
+        notifier = BulkAddNotifier(self.textChannel, embed, len(result))
+        await notifier.start()
         for song in result:
-            logging.debug(f"Searching for {song['url']}")
-            try:
-                # grab the video info for each song in the playlist
-                songInfo = await searcher.getVideoInfoFromURL(song["url"])
-            except Exception as e:
-                logging.error(e)
-                await self.textChannel.send(f"Unable to add song: {e}")
-                continue
-            # create a song object and append it to the playlist
-            youtubeSong = Song(songInfo["title"], song["url"], songInfo["link"], songInfo["thumbnail"], songInfo["duration"], user)
+            # create a song object from the flat playlist entry, the stream link is fetched right before it plays
+            youtubeSong = self.createSong(song, song["url"], user)
             # queue the song
-            await self.queueSong(youtubeSong)
+            await self.queueSong(youtubeSong, announce=False)
+            notifier.songAdded()
+        await notifier.finish()
         return
 
     async def handleSpotifyLink(self, user, url):
@@ -279,17 +412,17 @@ class MusicController:
         # get the song info from the youtube search query
         searcher = VideoSearcher()
         try:
-            result = await searcher.getVideoInfoFromQuery(query)
+            result = await searcher.getVideoInfoFromSpotify(spotifySongInfo["id"], query)
         except Exception as e:
             logging.error(e)
-            await self.textChannel.send(f"Unable to add song: {e}")
+            self.sendMessage(content=f"Unable to add song: {e}")
             return
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to find song.")
+            self.sendMessage(content="Unable to find song.")
             return
         # create a song object
-        youtubeSong = Song(result["title"], result["url"], result["link"], result["thumbnail"], result["duration"], user)
+        youtubeSong = self.createSong(result, result["url"], user)
         # queue the song
         await self.queueSong(youtubeSong)
         return
@@ -300,7 +433,7 @@ class MusicController:
         result = await self.spotify.getSpotifyPlaylistInfo(playlist)
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to find spotify playlist/album.")
+            self.sendMessage(content="Unable to find spotify playlist/album.")
             return
         # get the playlist name, number of songs, and thumbnail
         playlist_info = result.pop(0)
@@ -313,22 +446,29 @@ class MusicController:
         embed.set_thumbnail(url=thumbnail)
         embed.add_field(name="Playlist Name", value=playlist_info["title"], inline=False)
         embed.add_field(name="# of Songs", value=len(result), inline=False)
-        await self.textChannel.send(embed=embed)
+        # one embed is kept up to date with the progress instead of announcing every song
+        notifier = BulkAddNotifier(self.textChannel, embed, len(result))
+        await notifier.start()
         searcher = VideoSearcher()
-        for song in result:
+
+        # grab the video info for each song in the playlist
+        async def resolve(song):
             query = f"{song['title']} by {song['artist']}"
             logging.debug(f"Searching for {query}")
-            try:
-                # grab the video info for each song in the playlist
-                songInfo = await searcher.getVideoInfoFromQuery(query)
-            except Exception as e:
-                logging.error(e)
-                await self.textChannel.send(f"Unable to add song: {e}")
+            # songs we've matched before are queued from the cache, their stream link is fetched right before they play
+            return await searcher.getVideoInfoFromSpotify(song["id"], query, need_link=False, priority=BULK)
+
+        async for song, songInfo, error in self.resolveInOrder(result, resolve):
+            if error:
+                logging.error(f"Unable to add {song['title']}: {error}")
+                notifier.songFailed()
                 continue
             # create a song object
-            youtubeSong = Song(songInfo["title"], songInfo["url"], songInfo["link"], songInfo["thumbnail"], songInfo["duration"], user)
+            youtubeSong = self.createSong(songInfo, songInfo["url"], user)
             # queue the song
-            await self.queueSong(youtubeSong)
+            await self.queueSong(youtubeSong, announce=False)
+            notifier.songAdded()
+        await notifier.finish()
         return
 
     async def handleSoundCloudLink(self, user, url):
@@ -339,14 +479,14 @@ class MusicController:
             result = await searcher.getVideoInfoFromURL(url)
         except Exception as e:
             logging.error(e)
-            await self.textChannel.send(f"Unable to add song: {e}")
+            self.sendMessage(content=f"Unable to add song: {e}")
             return
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to find song.")
+            self.sendMessage(content="Unable to find song.")
             return
         # create a song object
-        soundcloudSong = Song(result["title"], url, result["link"], result["thumbnail"], result["duration"], user)
+        soundcloudSong = self.createSong(result, url, user)
         # queue the song
         await self.queueSong(soundcloudSong)
         return
@@ -358,7 +498,7 @@ class MusicController:
         result = await searcher.getPlaylistInfo(url)
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to find playlist.")
+            self.sendMessage(content="Unable to find playlist.")
             return
         # get the playlist name and the number of songs
         metadata = result.pop(0)
@@ -371,20 +511,16 @@ class MusicController:
         embed.set_thumbnail(url=thumbnail)
         embed.add_field(name="Playlist Name", value=metadata["playlist_name"], inline=False)
         embed.add_field(name="# of Songs", value=metadata["song_count"], inline=False)
-        await self.textChannel.send(embed=embed)
+        # one embed is kept up to date with the progress instead of announcing every song
+        notifier = BulkAddNotifier(self.textChannel, embed, len(result))
+        await notifier.start()
         for song in result:
-            logging.debug(f"Searching for {song['url']}")
-            try:
-                # grab the video info for each song in the playlist
-                songInfo = await searcher.getVideoInfoFromURL(song["url"])
-            except Exception as e:
-                logging.error(e)
-                await self.textChannel.send(f"Unable to add song: {e}")
-                continue
-            # create a song object and append it to the playlist
-            soundcloudSong = Song(songInfo["title"], song["url"], songInfo["link"], songInfo["thumbnail"], songInfo["duration"], user)
+            # create a song object from the flat playlist entry, the stream link is fetched right before it plays
+            soundcloudSong = self.createSong(song, song["url"], user)
             # queue the song
-            await self.queueSong(soundcloudSong)
+            await self.queueSong(soundcloudSong, announce=False)
+            notifier.songAdded()
+        await notifier.finish()
         return
 
     async def handleYoutubeSearch(self, user, query):
@@ -395,19 +531,70 @@ class MusicController:
             result = await searcher.getVideoInfoFromQuery(query)
         except Exception as e:
             logging.error(e)
-            await self.textChannel.send(f"Unable to add song: {e}")
+            self.sendMessage(content=f"Unable to add song: {e}")
             return
         # check if result came back successfully
         if not result:
-            await self.textChannel.send("Unable to find song.")
+            self.sendMessage(content="Unable to find song.")
             return
         # create a song object
-        youtubeSong = Song(result["title"], result["url"], result["link"], result["thumbnail"], result["duration"], user)
+        youtubeSong = self.createSong(result, result["url"], user)
         # queue the song
         await self.queueSong(youtubeSong)
         return
 
-    async def queueSong(self, song: Song):
+    # function to build a song for the queue, handing its stream link (if it came with one) to the link store
+    # and its title to the /play suggestions
+    def createSong(self, info: dict, url: str, user: discord.User) -> Song:
+        if info.get("link"):
+            self.links.put(url, info["link"], info.get("codec"))
+        self.titles.add(canonicalId(url), info["title"], url, info["duration"])
+        return Song(info["title"], url, info["thumbnail"], info["duration"], user.id if user else None)
+
+    # function to check if a song still needs a (new) stream link before it can play
+    def needsStreamLink(self, song: Song) -> bool:
+        return self.links.get(song.url) is None
+
+    # function to check if a song's stream link is already being fetched, for this song or another copy of it
+    def isResolving(self, song: Song) -> bool:
+        return canonicalId(song.url) in self.resolvingSongs
+
+    # function to fetch the stream link and full info for a song, sharing the lookup if one is already running
+    async def resolveSong(self, song: Song, priority: str = REFRESH, force: bool = False):
+        key = canonicalId(song.url)
+        task = self.resolvingSongs.get(key)
+        if task is None:
+
+            async def fetchSongInfo():
+                logging.debug(f"Fetching stream link for {song.url}")
+                searcher = VideoSearcher()
+                result = await searcher.getVideoInfoFromURL(song.url, priority, force)
+                song.thumbnail = intern(result["thumbnail"]) or song.thumbnail
+                # the queue keeps a running total of its durations and the titles it searches, so the changes go through it
+                self.songQueue.setTitle(song, intern(result["title"]) or song.title, hint=1)
+                self.songQueue.setDuration(song, result["duration"] or song.duration, hint=1)
+                self.links.put(song.url, result["link"], result.get("codec"))
+
+            task = asyncio.create_task(fetchSongInfo())
+            self.resolvingSongs[key] = task
+            task.add_done_callback(lambda _: self.resolvingSongs.pop(key, None))
+        # shield the lookup so a skip doesn't cancel it for everyone else waiting on it
+        await asyncio.shield(task)
+
+    # function to fetch stream links for the next few songs in the queue ahead of time
+    def prefetchSongs(self):
+        async def prefetch(song):
+            try:
+                await self.resolveSong(song, PREFETCH)
+            except Exception as e:
+                logging.warning(f"Unable to prefetch {song.url}: {e}")
+
+        # stream links for songs further down the queue would likely expire before they play anyway
+        for song in self.songQueue[1 : self.prefetchCount + 1]:
+            if not self.isResolving(song) and self.needsStreamLink(song):
+                asyncio.create_task(prefetch(song))
+
+    async def queueSong(self, song: Song, announce: bool = True):
         logging.debug("In queueSong")
         # check if song should play right away or go into the queue
         if not self.songQueue:
@@ -420,6 +607,14 @@ class MusicController:
             logging.debug("Adding song to queue.")
             self.songQueue.append(song)
             print("songQueue: ", self.songQueue)
+            if len(self.songQueue) <= self.prefetchCount + 1:
+                self.prefetchSongs()
+            # this song is up next, so it may need to be prepared before the current one ends
+            if len(self.songQueue) == 2 and self.nextUp is None:
+                self.scheduleNextUp()
+            # playlists announce their songs in one embed of their own
+            if not announce:
+                return
             # send the "Added to Queue" discord embed
             embed = discord.Embed(
                 title="Added to Queue:",
@@ -427,7 +622,10 @@ class MusicController:
                 color=0xA600FF,
             )
             embed.set_thumbnail(url=song.thumbnail)
-            await self.textChannel.send(embed=embed)
+            plays_in = self.timeUntil(len(self.songQueue) - 1)
+            embed.add_field(name="Plays In", value=formatDuration(plays_in) if plays_in is not None else "After the looping song", inline=True)
+            embed.add_field(name="Queue Length", value=formatDuration(self.remainingTime()), inline=True)
+            self.sendMessage(LOW, mergeKey="added", merge=mergeAddedToQueue, embed=embed)
             return
 
     async def queuePlaylist(self, playlist: list):
@@ -455,64 +653,183 @@ class MusicController:
         embed.set_thumbnail(url=thumbnail)
         for i, song in enumerate(playlist, start=1):
             embed.add_field(name=f"{i}", value=song.title, inline=False)
-        await self.textChannel.send(embed=embed)
+        embed.set_footer(text=f"Queue length: {formatDuration(self.remainingTime())}")
+        self.sendMessage(LOW, embed=embed)
         return
 
+    # function to get how many seconds of the current song have played
+    def getElapsedTime(self) -> int:
+        if self.start_time is None:
+            return 0
+        now = int(time.time())
+        paused = now - self.pause_start if self.pause_start is not None else 0
+        return now - self.start_time - self.pause_duration - paused
+
+    # function to get how many seconds until the song at a queue position starts, None while the current song loops
+    def timeUntil(self, index: int) -> int | None:
+        if index <= 0:
+            return 0
+        if self.isLooping:
+            return None
+        return max(0, self.songQueue.durationBefore(index) - self.getElapsedTime())
+
+    # function to get how many seconds of music are left in the queue, the rest of the current song included
+    def remainingTime(self) -> int:
+        return max(0, self.songQueue.totalDuration() - self.getElapsedTime())
+
+    # function to create the discord audio source for a song, this spawns the ffmpeg process right away
+    def createAudioSource(self, song: Song, start: int = 0) -> discord.AudioSource:
+        before_options = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+        if start:
+            before_options += f" -ss {start}"
+        stream = self.links.get(song.url)
+        if stream is None:
+            raise ValueError(f"No stream link for {song.url}")
+        link, codec = stream
+        spawn_start = time.perf_counter()
+        if self.playbackMode == "pcm":
+            mode = "pcm"
+            source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(link, before_options=before_options, options="-vn"), volume=self.volume)
+        # opus streams at normal volume are copied straight through, everything else is encoded to opus by ffmpeg
+        elif self.volume == 1.0 and codec == "opus":
+            mode = "opus-copy"
+            source = discord.FFmpegOpusAudio(link, codec="opus", before_options=before_options, options="-vn")
+        else:
+            mode = "opus-encode"
+            source = discord.FFmpegOpusAudio(link, before_options=before_options, options=f"-vn -filter:a volume={self.volume}")
+        FFMPEG_SPAWN.observe(time.perf_counter() - spawn_start, mode=mode)
+        return source
+
+    # function to swap the current song's source for a fresh one at the same position, e.g. after a volume change
+    def restartCurrentSong(self, voice_client: discord.VoiceClient):
+        song = self.songQueue[0]
+        if self.needsStreamLink(song):
+            return
+        old_source = voice_client.source
+        voice_client.source = self.createAudioSource(song, start=self.getElapsedTime())
+        # swapping the source resumes the player, so keep it paused if it was
+        if self.pause_start is not None:
+            voice_client.pause()
+        old_source.cleanup()
+
+    # function to throw away the prepared next song, killing its ffmpeg process
+    def discardNextUp(self):
+        if self.nextUpTimer is not None:
+            self.nextUpTimer.cancel()
+            self.nextUpTimer = None
+        if self.nextUp is not None:
+            self.nextUp[1].cleanup()
+            self.nextUp = None
+
+    # function to schedule the next song's source to be opened shortly before the current one ends
+    def scheduleNextUp(self):
+        self.discardNextUp()
+        if self.start_time is None or not self.songQueue or not self.songQueue[0].duration:
+            return
+        delay = max(0, self.songQueue[0].duration - self.getElapsedTime() - self.preloadSeconds)
+        self.nextUpTimer = self.client.loop.call_later(delay, lambda: asyncio.create_task(self.prepareNextUp()))
+
+    # function to open and pre-buffer the ffmpeg source of whichever song plays after the current one
+    async def prepareNextUp(self):
+        self.nextUpTimer = None
+        if self.start_time is None or not self.songQueue:
+            return
+        # a pause pushes the end of the song back, so check again later
+        remaining = self.songQueue[0].duration - self.getElapsedTime()
+        if remaining > self.preloadSeconds + 1:
+            self.scheduleNextUp()
+            return
+        current = self.songQueue[0]
+        song = current if self.isLooping else (self.songQueue[1] if len(self.songQueue) > 1 else None)
+        if song is None:
+            return
+        try:
+            if self.needsStreamLink(song):
+                await self.resolveSong(song)
+        except Exception as e:
+            logging.warning(f"Unable to prepare {song.url}: {e}")
+            return
+        # skip the work if the song finished or the queue changed while the link was being fetched
+        if not self.songQueue or self.songQueue[0] is not current or self.nextUp is not None:
+            return
+        logging.debug(f"Preparing next song: {song.title}")
+        self.nextUp = (song, self.createAudioSource(song))
+
+    # function to move on from a song that finished playing
+    async def finishSong(self, song: Song):
+        if self.isLooping:
+            logging.debug("Song finished, replaying previous song.")
+        else:
+            logging.debug("Song finished, popping from queue and checking next")
+            if self.songQueue and self.songQueue[0] is song:
+                self.songQueue.popleft()
+        await self.playSong()
+
     async def playSong(self):
         logging.debug("In playSong.")
 
         # check to make sure there is a song in queue
         if not self.songQueue:
-            await self.textChannel.send("No more songs to play.")
+            self.sendMessage(content="No more songs to play.")
+            self.songEndedAt = None
             self.start_time = None
             self.pause_duration = 0
             self.pause_start = None
             return
 
-        ffmpeg_options = {"before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5", "options": "-vn"}
-
         # get the next song to play
         song = self.songQueue[0]
 
-        if getSongExpiration(song.link) <= int(time.time()):
-            logging.debug("Stream URL is expired. Fetching new one")
-            # get the song info from the link
-            searcher = VideoSearcher()
+        # use the source that was opened ahead of time if it is for this song
+        player = None
+        if self.nextUp is not None and self.nextUp[0] is song:
+            player = self.nextUp[1]
+            self.nextUp = None
+        self.discardNextUp()
+
+        if player is None and self.needsStreamLink(song):
+            logging.debug("Stream URL is missing or expired. Fetching new one")
             try:
-                result = await searcher.getVideoInfoFromURL(song.url)
+                await self.resolveSong(song)
             except Exception as e:
                 logging.error(e)
-                await self.textChannel.send(f"Unable to add song: {e}")
+                self.sendMessage(content=f"Unable to play song: {e}")
+                # drop the broken song and move on to the next one
+                if self.songQueue and self.songQueue[0] is song:
+                    self.songQueue.popleft()
+                await self.playSong()
+                return
+            # the queue may have been stopped or changed while the link was being fetched
+            if not self.songQueue or self.songQueue[0] is not song:
+                await self.playSong()
                 return
-            # update the current songs stream link
-            song.link = result["link"]
 
         # create the discord player for current song
-        source = discord.FFmpegPCMAudio(song.link, **ffmpeg_options)
-        player = discord.PCMVolumeTransformer(source, volume=self.volume)
+        if player is None:
+            player = self.createAudioSource(song)
 
-        # function to call after a song is done playing
+        # function to call after a song is done playing, this runs on discord's audio thread
         def after_playing(error):
             if error:
                 logging.error(f"Error during playback: {error}")
             else:
-                if self.isLooping:
-                    logging.debug("Song finished, replaying previous song.")
-                else:
-                    logging.debug("Song finished, popping from queue and checking next")
-                    if self.songQueue:
-                        self.songQueue.pop(0)
-                fut = asyncio.run_coroutine_threadsafe(self.playSong(), self.client.loop)
+                self.songEndedAt = time.monotonic()
+                # hop back onto the event loop before touching the queue
+                fut = asyncio.run_coroutine_threadsafe(self.finishSong(song), self.client.loop)
                 fut.add_done_callback(lambda f: f.exception())
 
         # get the voice client and play the song
         voice_client = discord.utils.get(self.client.voice_clients, guild=self.guild)
         voice_client.play(player, after=after_playing)
+        if self.songEndedAt is not None:
+            PLAYBACK_GAP.observe(time.monotonic() - self.songEndedAt)
+            self.songEndedAt = None
 
         # start the duration timer
         self.start_time = int(time.time())
         self.pause_duration = 0
         self.pause_start = None
+        self.scheduleNextUp()
 
         # send the "Now Playing" discord embed
         embed = discord.Embed(
@@ -521,4 +838,9 @@ class MusicController:
             color=0xA600FF,
         )
         embed.set_thumbnail(url=song.thumbnail)
-        await self.textChannel.send(embed=embed, view=MusicButtons(client=self.client, musicController=self))
+        # a newer "Now Playing" replaces one that hasn't been sent yet
+        self.sendMessage(HIGH, mergeKey="now_playing", embed=embed, view=MusicButtons(client=self.client))
+
+        # get the next few songs ready while this one plays, and keep their links from expiring before they do
+        self.prefetchSongs()
+        self.refresher.watch(self)
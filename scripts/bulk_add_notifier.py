@@ -0,0 +1,79 @@
+import asyncio
+import os
+import time
+
+import discord
+
+from scripts.message_scheduler import HIGH, LOW, NORMAL, getMessageScheduler
+
+
+class BulkAddNotifier:
+    # keeps one "Adding Playlist" embed up to date while a playlist is queued, instead of one message per song
+    def __init__(self, channel: discord.abc.Messageable, embed: discord.Embed, total: int, interval: float = None):
+        self.channel = channel
+        self.embed = embed
+        self.total = total
+        # the most often the embed gets edited, in seconds
+        self.interval = interval if interval is not None else max(0.5, float(os.getenv("QUEUE_NOTIFY_INTERVAL", 2)))
+        self.added = 0
+        self.failed = 0
+        self.finished = False
+        self.message = None
+        self.lastEdit = 0
+        self.editTask = None
+
+    # function to set a field on the embed, adding it the first time
+    def setField(self, name: str, value: str):
+        for i, field in enumerate(self.embed.fields):
+            if field.name == name:
+                self.embed.set_field_at(i, name=name, value=value, inline=False)
+                return
+        self.embed.add_field(name=name, value=value, inline=False)
+
+    # function to fill the progress into the embed
+    def render(self) -> discord.Embed:
+        self.embed.title = "Playlist Added:" if self.finished else "Adding Playlist:"
+        self.setField("Added", f"{self.added}/{self.total}" + ("" if self.finished else "..."))
+        if self.failed:
+            self.setField("Failed", str(self.failed))
+        return self.embed
+
+    # function to send the embed the progress will be shown in
+    async def start(self):
+        self.message = await getMessageScheduler().send(self.channel, NORMAL, embed=self.render())
+        self.lastEdit = time.monotonic()
+
+    # function to count a song that made it into the queue
+    def songAdded(self):
+        self.added += 1
+        self.scheduleEdit()
+
+    # function to count a song that couldn't be queued
+    def songFailed(self):
+        self.failed += 1
+        self.scheduleEdit()
+
+    # function to edit the embed once the current window is over, every change in between is folded into that one edit
+    def scheduleEdit(self):
+        if self.editTask is None and self.message is not None and not self.finished:
+            self.editTask = asyncio.create_task(self.editLater())
+
+    async def editLater(self):
+        await asyncio.sleep(max(0, self.lastEdit + self.interval - time.monotonic()))
+        self.editTask = None
+        await self.edit()
+
+    async def edit(self):
+        self.lastEdit = time.monotonic()
+        # progress updates can be dropped if the channel is busy, the final count goes out at HIGH so it never goes stale
+        # or gets dropped, and a progress edit still waiting is folded into it rather than the other way round
+        await getMessageScheduler().edit(self.message, HIGH if self.finished else LOW, embed=self.render())
+
+    # function to show the final count once every song has been handled
+    async def finish(self):
+        self.finished = True
+        if self.editTask is not None:
+            self.editTask.cancel()
+            self.editTask = None
+        if self.message is not None:
+            await self.edit()
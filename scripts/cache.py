@@ -0,0 +1,282 @@
+import collections
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+# a cached stream link is only handed out if it stays valid for at least this many more seconds
+LINK_EXPIRY_MARGIN = 300
+# search results go stale as new uploads appear, so they are only kept for a day
+SEARCH_RESULTS_TTL = 24 * 60 * 60
+# how many writes happen between checks of the size limit
+EVICTION_INTERVAL = 100
+# cache hits only mark rows as recently used in memory, they're written in one go once this many have built up
+TOUCH_BATCH = 200
+# table -> its primary key column, for every table trimmed to the size limit
+TABLE_KEYS = {"videos": "key", "queries": "query", "searches": "query", "spotify_matches": "track_id", "titles": "key"}
+
+
+# function to normalize a search query so small differences in case and spacing share a cache entry
+def normalizeQuery(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class MetadataCache:
+    def __init__(self, path: Path, max_entries: int = 50000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        self.writes = 0
+        # table -> {row key: time it was last used} not written to the database yet
+        self.touched = {table: {} for table in TABLE_KEYS}
+        self.touchCount = 0
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS videos (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                title TEXT,
+                duration INTEGER,
+                thumbnail TEXT,
+                link TEXT,
+                link_expires INTEGER,
+                codec TEXT,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS videos_last_used ON videos (last_used);
+            CREATE TABLE IF NOT EXISTS queries (
+                query TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS queries_last_used ON queries (last_used);
+            CREATE TABLE IF NOT EXISTS searches (
+                query TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used);
+            CREATE TABLE IF NOT EXISTS spotify_matches (
+                track_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS spotify_matches_last_used ON spotify_matches (last_used);
+            CREATE TABLE IF NOT EXISTS titles (
+                key TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                url TEXT NOT NULL,
+                duration INTEGER,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS titles_last_used ON titles (last_used);
+            """
+        )
+        # caches created before the codec was stored need the column added
+        if "codec" not in [column[1] for column in self.db.execute("PRAGMA table_info(videos)")]:
+            self.db.execute("ALTER TABLE videos ADD COLUMN codec TEXT")
+        logging.info(f"Opened metadata cache at {path}")
+
+    # function to count a hit or miss for the given kind of lookup
+    def record(self, kind: str, hit: bool):
+        if hit:
+            self.hits[kind] += 1
+        else:
+            self.misses[kind] += 1
+
+    # function to get the hit/miss counters for every kind of lookup
+    def stats(self) -> dict:
+        kinds = set(self.hits) | set(self.misses)
+        return {kind: {"hits": self.hits[kind], "misses": self.misses[kind]} for kind in sorted(kinds)}
+
+    # function to mark a row as recently used, it's written with the next batch so a cache hit stays a read
+    def touch(self, table: str, key: str, now: float = None):
+        self.touched[table][key] = now or time.time()
+        self.touchCount += 1
+        if self.touchCount >= TOUCH_BATCH:
+            self.flushTouches()
+
+    # function to write every pending last_used update in one transaction
+    def flushTouches(self):
+        if not self.touchCount:
+            return
+        touched, self.touched = self.touched, {table: {} for table in TABLE_KEYS}
+        self.touchCount = 0
+        self.db.execute("BEGIN")
+        try:
+            for table, rows in touched.items():
+                if rows:
+                    self.db.executemany(f"UPDATE {table} SET last_used = MAX(last_used, ?) WHERE {TABLE_KEYS[table]} = ?", [(used, key) for key, used in rows.items()])
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    # function to turn a videos row into the same shape VideoSearcher returns
+    def rowToVideo(self, row) -> dict:
+        url, title, duration, thumbnail, link, link_expires, codec = row
+        # only hand out the stream link while it is still comfortably valid
+        if not link or not link_expires or link_expires <= int(time.time()) + LINK_EXPIRY_MARGIN:
+            link = codec = None
+        return {"title": title, "duration": duration, "thumbnail": thumbnail, "link": link, "codec": codec, "url": url}
+
+    # function to get the cached info for a video, the link is None if it has expired
+    def getVideo(self, key: str) -> dict | None:
+        row = self.db.execute("SELECT url, title, duration, thumbnail, link, link_expires, codec FROM videos WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.record("video", False)
+            return None
+        self.touch("videos", key)
+        video = self.rowToVideo(row)
+        self.record("video", True)
+        self.record("link", video["link"] is not None)
+        return video
+
+    # function to store the info for a video, the stream link is kept until it expires
+    def putVideo(self, key: str, url: str, info: dict, link_expires: int | None):
+        self.db.execute(
+            """
+            INSERT INTO videos (key, url, title, duration, thumbnail, link, link_expires, codec, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                url = excluded.url, title = excluded.title, duration = excluded.duration, thumbnail = excluded.thumbnail,
+                link = excluded.link, link_expires = excluded.link_expires, codec = excluded.codec, last_used = excluded.last_used
+            """,
+            (key, url, info.get("title"), info.get("duration"), info.get("thumbnail"), info.get("link") if link_expires else None, link_expires, info.get("codec"), time.time()),
+        )
+        self.written()
+
+    # function to get the cached video a search query resolved to
+    def getQuery(self, query: str) -> dict | None:
+        row = self.db.execute(
+            "SELECT videos.url, title, duration, thumbnail, link, link_expires, codec, videos.key FROM queries JOIN videos ON videos.key = queries.key WHERE query = ?",
+            (query,),
+        ).fetchone()
+        if row is None:
+            self.record("query", False)
+            return None
+        now = time.time()
+        self.touch("queries", query, now)
+        self.touch("videos", row[-1], now)
+        video = self.rowToVideo(row[:-1])
+        self.record("query", True)
+        self.record("link", video["link"] is not None)
+        return video
+
+    # function to remember which video a search query resolved to
+    def putQuery(self, query: str, key: str):
+        self.db.execute(
+            "INSERT INTO queries (query, key, last_used) VALUES (?, ?, ?) ON CONFLICT (query) DO UPDATE SET key = excluded.key, last_used = excluded.last_used",
+            (query, key, time.time()),
+        )
+        self.written()
+
+    # function to get cached search results that are still fresh
+    def getSearch(self, query: str) -> list | None:
+        now = time.time()
+        row = self.db.execute("SELECT results FROM searches WHERE query = ? AND created > ?", (query, now - SEARCH_RESULTS_TTL)).fetchone()
+        if row is None:
+            self.record("search", False)
+            return None
+        self.touch("searches", query, now)
+        self.record("search", True)
+        return json.loads(row[0])
+
+    # function to store the results of a search
+    def putSearch(self, query: str, results: list):
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO searches (query, results, created, last_used) VALUES (?, ?, ?, ?) ON CONFLICT (query) DO UPDATE SET results = excluded.results, created = excluded.created, last_used = excluded.last_used",
+            (query, json.dumps(results), now, now),
+        )
+        self.written()
+
+    # function to get the YouTube URL a spotify track was matched to
+    def getSpotifyMatch(self, track_id: str) -> str | None:
+        row = self.db.execute("SELECT url FROM spotify_matches WHERE track_id = ?", (track_id,)).fetchone()
+        if row is None:
+            self.record("spotify", False)
+            return None
+        self.touch("spotify_matches", track_id)
+        self.record("spotify", True)
+        return row[0]
+
+    # function to remember which YouTube video a spotify track was matched to
+    def putSpotifyMatch(self, track_id: str, url: str):
+        self.db.execute(
+            "INSERT INTO spotify_matches (track_id, url, last_used) VALUES (?, ?, ?) ON CONFLICT (track_id) DO UPDATE SET url = excluded.url, last_used = excluded.last_used",
+            (track_id, url, time.time()),
+        )
+        self.written()
+
+    # function to remember the titles of songs that were queued, for /play suggestions, in one transaction
+    def putTitles(self, rows: list):
+        now = time.time()
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany(
+                "INSERT INTO titles (key, title, url, duration, last_used) VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET title = excluded.title, url = excluded.url, duration = excluded.duration, last_used = excluded.last_used",
+                [(*row, now) for row in rows],
+            )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self.written()
+
+    # function to get (key, title, url, duration) for every song we know the title of, most recently used last
+    def loadTitles(self) -> list:
+        # videos looked up before titles were kept separately still make good suggestions
+        return self.db.execute(
+            """
+            SELECT key, title, url, duration FROM (
+                SELECT key, title, url, duration, last_used FROM videos WHERE title IS NOT NULL AND key NOT IN (SELECT key FROM titles)
+                UNION ALL SELECT key, title, url, duration, last_used FROM titles
+            ) ORDER BY last_used
+            """
+        ).fetchall()
+
+    # function to keep track of writes and trim the cache every so often
+    def written(self):
+        self.writes += 1
+        if self.writes % EVICTION_INTERVAL == 0:
+            self.evict()
+
+    # function to drop the least recently used rows from every table that is over the size limit
+    def evict(self):
+        # rows only count as used once their touches are written
+        self.flushTouches()
+        for table in TABLE_KEYS:
+            # the newest row past the limit, found by walking the last_used index, or None if the table isn't over it
+            row = self.db.execute(f"SELECT last_used FROM {table} ORDER BY last_used DESC LIMIT 1 OFFSET ?", (self.max_entries,)).fetchone()
+            if row is None:
+                continue
+            cursor = self.db.execute(f"DELETE FROM {table} WHERE last_used <= ?", row)
+            if cursor.rowcount > 0:
+                logging.debug(f"Evicted {cursor.rowcount} rows from the {table} cache")
+
+    # function to write the last pending touches when the bot shuts down
+    def close(self):
+        try:
+            self.flushTouches()
+        except sqlite3.Error as e:
+            logging.warning(f"Unable to save which cached rows were used last: {e}")
+
+
+metadataCache = None
+
+
+# function to get the metadata cache shared by the whole bot, opening it on first use
+def getMetadataCache() -> MetadataCache:
+    global metadataCache
+    if metadataCache is None:
+        root_dir = Path(__file__).resolve().parent.parent
+        path = os.getenv("METADATA_CACHE_PATH") or root_dir / "metadata_cache.db"
+        metadataCache = MetadataCache(path, max_entries=int(os.getenv("METADATA_CACHE_MAX_ENTRIES", 50000)))
+    return metadataCache
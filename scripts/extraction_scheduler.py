@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.metrics import EXTRACTION_WAIT
+
+# priority classes, from most to least latency sensitive
+INTERACTIVE = "interactive"  # /play, /search and anything else a user is actively waiting on
+REFRESH = "refresh"  # fetching the stream link of the song that is about to play
+PREFETCH = "prefetch"  # getting upcoming songs ready ahead of time
+BULK = "bulk"  # resolving the songs of an imported playlist
+# how urgent each class is, a lookup shared between classes is moved up to the most urgent one waiting on it
+PRIORITY_RANKS = {INTERACTIVE: 3, REFRESH: 2, PREFETCH: 1, BULK: 0}
+
+# (worker threads, queued requests, whether callers wait for room instead of failing when the queue is full)
+DEFAULT_LIMITS = {
+    INTERACTIVE: (4, 16, False),
+    REFRESH: (2, 32, True),
+    PREFETCH: (2, 32, False),
+    BULK: (8, 2000, True),
+}
+
+
+class ExtractionBusyError(Exception):
+    pass
+
+
+class PriorityClass:
+    def __init__(self, name: str, max_workers: int, max_queued: int, wait_when_full: bool):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.wait_when_full = wait_when_full
+        # every class gets its own threads, so a busy class can never take workers from another one
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"ytdlp-{name}")
+        self.slots = asyncio.Semaphore(max_workers + max_queued)
+        self.active = 0
+
+
+class ExtractionScheduler:
+    def __init__(self, limits: dict = None):
+        self.classes = {name: PriorityClass(name, *limit) for name, limit in (limits or DEFAULT_LIMITS).items()}
+
+    # function to run a blocking yt-dlp call on the threads of the given priority class
+    async def run(self, priority: str, func, *args):
+        priorityClass = self.classes[priority]
+        queued_at = time.monotonic()
+
+        # runs on the worker thread, so the wait covers both the slot queue and the executor queue
+        def timedFunc():
+            EXTRACTION_WAIT.observe(time.monotonic() - queued_at, priority=priority)
+            return func(*args)
+
+        if priorityClass.slots.locked() and not priorityClass.wait_when_full:
+            logging.warning(f"{priority} extraction queue is full, rejecting request")
+            raise ExtractionBusyError("The bot is busy right now, please try again in a moment.")
+        async with priorityClass.slots:
+            priorityClass.active += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(priorityClass.executor, timedFunc)
+            finally:
+                priorityClass.active -= 1
+
+    # function to get how many requests are running or waiting in each class
+    def stats(self) -> dict:
+        return {name: priorityClass.active for name, priorityClass in self.classes.items()}
+
+    # function to stop every worker thread when the bot shuts down
+    def shutdown(self):
+        for priorityClass in self.classes.values():
+            priorityClass.executor.shutdown(wait=False, cancel_futures=True)
+
+
+extractionScheduler = None
+
+
+# function to get the extraction scheduler shared by the whole bot
+def getExtractionScheduler() -> ExtractionScheduler:
+    global extractionScheduler
+    if extractionScheduler is None:
+        limits = {}
+        for name, (workers, queued, wait_when_full) in DEFAULT_LIMITS.items():
+            # e.g. EXTRACTION_BULK_WORKERS=8 and EXTRACTION_BULK_QUEUE=2000
+            workers = max(1, int(os.getenv(f"EXTRACTION_{name.upper()}_WORKERS", workers)))
+            queued = max(0, int(os.getenv(f"EXTRACTION_{name.upper()}_QUEUE", queued)))
+            limits[name] = (workers, queued, wait_when_full)
+        extractionScheduler = ExtractionScheduler(limits)
+    return extractionScheduler
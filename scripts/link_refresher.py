@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import time
+import weakref
+import zlib
+
+from scripts.extraction_scheduler import PREFETCH
+from scripts.link_store import getLinkStore
+from scripts.metrics import LINK_REFRESHES
+
+# seconds between two background refreshes, so links that expire together don't all hit yt-dlp at once
+REFRESH_SPACING = 1
+# the longest the refresher sleeps before looking at the queues again, queues change without telling it
+MAX_SLEEP = 30
+# seconds to wait before trying a failed refresh again
+RETRY_DELAY = 60
+
+linkRefresher = None
+
+
+class LinkRefresher:
+    def __init__(self, lead: int = 15 * 60, unknown_after: int = 30 * 60, window: int = 3):
+        self.links = getLinkStore()
+        # refresh a link this many seconds before it expires, plus up to half as much again to spread them out
+        self.lead = lead
+        # links that don't say when they expire are refreshed once they are this old
+        self.unknown_after = unknown_after
+        # how many of the songs up next in each guild's queue are kept fresh
+        self.window = window
+        # guild id -> music controller, a controller that's thrown away stops being watched
+        self.controllers = weakref.WeakValueDictionary()
+        # song url -> time a failed refresh may be tried again
+        self.retries = {}
+        self.task = None
+        self.refreshed = 0
+        self.failed = 0
+
+    # function to start keeping the front of a guild's queue fresh
+    def watch(self, controller):
+        self.controllers[controller.guild.id] = controller
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    # function to work out when a song's link should be refreshed, None if it has no link to refresh
+    def refreshAt(self, song) -> float | None:
+        expiry = self.links.expiry(song.url)
+        if expiry is None:
+            return None
+        expires, guessed = expiry
+        if guessed:
+            # we can't tell when it really expires, so assume it's sooner rather than later
+            return expires - self.links.default_ttl + self.unknown_after
+        # the same song always gets the same offset, so every guild agrees on when it's due
+        return expires - self.lead - zlib.crc32(song.url.encode()) % (self.lead // 2 + 1)
+
+    # function to get the songs of a guild whose links are kept fresh, the playing one has already opened its stream so
+    # it only counts when loop will play it again
+    def windowSongs(self, controller) -> list:
+        return controller.songQueue[0 if controller.isLooping else 1 : self.window + 1]
+
+    # function to find the songs that are due for a refresh, and when the next one will be
+    def dueSongs(self) -> tuple:
+        now = time.time()
+        self.retries = {url: retry_at for url, retry_at in self.retries.items() if retry_at > now}
+        due = []
+        next_due = now + MAX_SLEEP
+        for controller in list(self.controllers.values()):
+            for song in self.windowSongs(controller):
+                refresh_at = self.refreshAt(song)
+                if refresh_at is None or controller.isResolving(song) or song.url in self.retries:
+                    continue
+                if refresh_at <= now:
+                    due.append((refresh_at, controller, song))
+                else:
+                    next_due = min(next_due, refresh_at)
+        # the links closest to expiring go first
+        due.sort(key=lambda entry: entry[0])
+        return due, next_due
+
+    async def refresh(self, controller, song):
+        try:
+            # the cached link is still valid at this point, so it has to be extracted again to get a newer one
+            await controller.resolveSong(song, PREFETCH, force=True)
+        except Exception as e:
+            self.failed += 1
+            self.retries[song.url] = time.time() + RETRY_DELAY
+            LINK_REFRESHES.inc(result="failed")
+            logging.warning(f"Unable to refresh the stream link for {song.url}: {e}")
+            return
+        refresh_at = self.refreshAt(song)
+        if refresh_at is not None and refresh_at <= time.time():
+            # yt-dlp handed back a link that's due just as soon, so wait before trying again instead of looping on it
+            self.retries[song.url] = time.time() + RETRY_DELAY
+            LINK_REFRESHES.inc(result="unchanged")
+            logging.info(f"Refreshing {song.url} didn't push its stream link's expiry back")
+            return
+        self.refreshed += 1
+        LINK_REFRESHES.inc(result="ok")
+
+    # function to refresh every link that is due, one at a time, returns when the next one is due if none were
+    async def refreshDue(self) -> float | None:
+        due, next_due = self.dueSongs()
+        for refresh_at, controller, song in due:
+            # the song may have been skipped or refreshed by playSong while earlier ones were running
+            if song in self.windowSongs(controller) and self.refreshAt(song) == refresh_at:
+                await self.refresh(controller, song)
+                await asyncio.sleep(REFRESH_SPACING)
+        return None if due else next_due
+
+    # function to keep refreshing links ahead of their expiry, for as long as any guild is watched
+    async def run(self):
+        while self.controllers:
+            # the controllers are only referenced inside refreshDue, so one can go away while this sleeps
+            next_due = await self.refreshDue()
+            if next_due is not None:
+                await asyncio.sleep(min(MAX_SLEEP, max(REFRESH_SPACING, next_due - time.time())))
+
+    # function to stop refreshing when the bot shuts down
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+# function to get the link refresher shared by every guild
+def getLinkRefresher() -> LinkRefresher:
+    global linkRefresher
+    if linkRefresher is None:
+        lead = max(60, int(os.getenv("LINK_REFRESH_LEAD", 15 * 60)))
+        unknown_after = max(60, int(os.getenv("LINK_REFRESH_UNKNOWN_AFTER", 30 * 60)))
+        linkRefresher = LinkRefresher(lead, unknown_after, max(1, int(os.getenv("LINK_REFRESH_WINDOW", 3))))
+    return linkRefresher
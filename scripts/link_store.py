@@ -0,0 +1,59 @@
+import os
+import time
+
+from scripts.cache import EVICTION_INTERVAL, LINK_EXPIRY_MARGIN
+from scripts.resolvers import canonicalId
+from scripts.ytDLP import getSongExpiration
+
+linkStore = None
+
+
+class StreamLinkStore:
+    def __init__(self, default_ttl: int = 6 * 60 * 60):
+        # links that don't say when they expire are kept this long, about as long as a youtube link lasts
+        self.default_ttl = default_ttl
+        # canonical id -> (stream link, audio codec, unix time it expires, whether that time is a guess)
+        self.links = {}
+        self.writes = 0
+
+    # function to remember the stream link for a video, shared by every guild that has it queued
+    def put(self, url: str, link: str, codec: str = None):
+        expires = getSongExpiration(link)
+        guessed = expires is None
+        if guessed:
+            expires = int(time.time()) + self.default_ttl
+        self.links[canonicalId(url)] = (link, codec, expires, guessed)
+        self.writes += 1
+        if self.writes % EVICTION_INTERVAL == 0:
+            self.purge()
+
+    # function to get (stream link, codec) for a video, or None if there isn't one that stays valid long enough to play
+    def get(self, url: str):
+        entry = self.links.get(canonicalId(url))
+        if entry is None or entry[2] <= int(time.time()) + LINK_EXPIRY_MARGIN:
+            return None
+        return entry[0], entry[1]
+
+    # function to get (unix time the link expires, whether that time is a guess) for a video, or None if it has no link
+    def expiry(self, url: str):
+        entry = self.links.get(canonicalId(url))
+        return None if entry is None else (entry[2], entry[3])
+
+    def discard(self, url: str):
+        self.links.pop(canonicalId(url), None)
+
+    # function to drop every link that has already expired
+    def purge(self):
+        now = int(time.time())
+        for key in [key for key, entry in self.links.items() if entry[2] <= now]:
+            del self.links[key]
+
+    def __len__(self):
+        return len(self.links)
+
+
+def getLinkStore() -> StreamLinkStore:
+    global linkStore
+    if linkStore is None:
+        linkStore = StreamLinkStore(int(os.getenv("STREAM_LINK_TTL", 6 * 60 * 60)))
+    return linkStore
@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+import discord
+
+from scripts.metrics import DISCORD_SEND
+
+# message priorities, lower is sent first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# seconds a message may wait in its channel's queue before it isn't worth sending anymore, None means always send it
+MAX_AGE = {HIGH: None, NORMAL: 120, LOW: 30}
+
+messageScheduler = None
+
+
+class OutboundMessage:
+    def __init__(self, deliver, kwargs: dict, priority: int, mergeKey, merge):
+        # channel.send or message.edit, called with kwargs once the message's turn comes
+        self.deliver = deliver
+        self.kwargs = kwargs
+        self.priority = priority
+        self.mergeKey = mergeKey
+        self.merge = merge
+        self.queuedAt = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        # set when the message was merged into a newer one or dropped, it's skipped when it comes off the heap
+        self.cancelled = False
+
+    def isStale(self) -> bool:
+        max_age = MAX_AGE.get(self.priority)
+        return max_age is not None and time.monotonic() - self.queuedAt > max_age
+
+    def resolve(self, result):
+        if not self.future.done():
+            self.future.set_result(result)
+
+
+class ChannelOutbox:
+    def __init__(self):
+        self.heap = []
+        # merge key -> the message with that key still waiting to be sent
+        self.pending = {}
+        self.size = 0
+        self.worker = None
+
+
+class SendBudget:
+    # token bucket shared by every channel, so the bot as a whole stays under discord's global limit
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # the lock hands out tokens in the order channels asked for them, and every channel asks for one at a time
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class MessageScheduler:
+    def __init__(self, rate: float = 20, burst: int = 20, queue_limit: int = 50):
+        self.budget = SendBudget(rate, burst)
+        self.queue_limit = queue_limit
+        self.outboxes = {}
+        self.counter = itertools.count()
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+
+    # function to queue a message for a channel, the returned future gets the sent discord.Message (None if it was dropped)
+    def send(self, channel: discord.abc.Messageable, priority: int = NORMAL, mergeKey=None, merge=None, **kwargs) -> asyncio.Future:
+        return self.submit(channel.id, channel.send, kwargs, priority, mergeKey, merge)
+
+    # function to queue an edit of a message, a newer edit of the same message replaces one that hasn't been sent yet
+    def edit(self, message: discord.Message, priority: int = LOW, **kwargs) -> asyncio.Future:
+        return self.submit(message.channel.id, message.edit, kwargs, priority, ("edit", message.id), None)
+
+    def submit(self, channel_id: int, deliver, kwargs: dict, priority: int, mergeKey, merge) -> asyncio.Future:
+        outbox = self.outboxes.get(channel_id)
+        if outbox is None:
+            outbox = self.outboxes[channel_id] = ChannelOutbox()
+        message = OutboundMessage(deliver, kwargs, priority, mergeKey, merge)
+
+        waiting = outbox.pending.get(mergeKey) if mergeKey is not None else None
+        if waiting is not None:
+            # fold the waiting message into the new one, merge combines them and without it the newer one wins
+            self.merged += 1
+            if merge is not None:
+                message.kwargs = merge(waiting.kwargs, kwargs)
+            message.priority = min(waiting.priority, priority)
+            self.discard(outbox, waiting)
+            message.future.add_done_callback(lambda future: waiting.resolve(future.result()))
+        if mergeKey is not None:
+            outbox.pending[mergeKey] = message
+
+        heapq.heappush(outbox.heap, (message.priority, next(self.counter), message))
+        outbox.size += 1
+        if outbox.size > self.queue_limit:
+            # too much is waiting for this channel, give up on the oldest of the least important messages, HIGH ones are
+            # always sent like MAX_AGE says
+            droppable = [entry for entry in outbox.heap if not entry[2].cancelled and entry[0] != HIGH]
+            if droppable:
+                worst = max(droppable, key=lambda entry: (entry[0], -entry[1]))
+                self.dropped += 1
+                self.discard(outbox, worst[2])
+                worst[2].resolve(None)
+
+        if outbox.worker is None:
+            outbox.worker = asyncio.create_task(self.drain(channel_id, outbox))
+        return message.future
+
+    # function to take a message out of its outbox without sending it
+    def discard(self, outbox: ChannelOutbox, message: OutboundMessage):
+        message.cancelled = True
+        outbox.size -= 1
+        if message.mergeKey is not None and outbox.pending.get(message.mergeKey) is message:
+            del outbox.pending[message.mergeKey]
+
+    # function to send one channel's messages one at a time, most important first
+    async def drain(self, channel_id: int, outbox: ChannelOutbox):
+        try:
+            while outbox.heap:
+                message = heapq.heappop(outbox.heap)[2]
+                if message.cancelled:
+                    continue
+                self.discard(outbox, message)
+                if message.isStale():
+                    self.dropped += 1
+                    message.resolve(None)
+                    continue
+                await self.budget.acquire()
+                start = time.perf_counter()
+                try:
+                    result = await message.deliver(**message.kwargs)
+                    self.sent += 1
+                    DISCORD_SEND.observe(time.perf_counter() - start, priority=PRIORITY_NAMES.get(message.priority, message.priority))
+                except Exception as e:
+                    logging.warning(f"Unable to send message to channel {channel_id}: {e}")
+                    result = None
+                message.resolve(result)
+        finally:
+            outbox.worker = None
+            if not outbox.heap and self.outboxes.get(channel_id) is outbox:
+                del self.outboxes[channel_id]
+
+
+def getMessageScheduler() -> MessageScheduler:
+    global messageScheduler
+    if messageScheduler is None:
+        rate = max(0.1, float(os.getenv("MESSAGE_SEND_RATE", 20)))
+        messageScheduler = MessageScheduler(rate, max(1, int(rate)), max(1, int(os.getenv("MESSAGE_QUEUE_LIMIT", 50))))
+    return messageScheduler
@@ -0,0 +1,199 @@
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+
+from aiohttp import web
+
+# histogram buckets in seconds, from a millisecond up to a minute
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# every metric registers itself here when it's created, in the order they're shown
+registry = []
+metricsRunner = None
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        # label values -> value, some metrics are updated from yt-dlp and audio threads
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def formatLabels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> dict:
+        with self.lock:
+            return dict(self.values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.samples().items()):
+            lines.append(f"{self.name}{self.formatLabels(key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        super().__init__(name, description, labels)
+        # optional function returning {label values: value}, read every time the gauge is scraped
+        self.collect = None
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self) -> dict:
+        if self.collect is not None:
+            return self.collect()
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # [count per bucket (the last one is +Inf), sum, count]
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> dict:
+        with self.lock:
+            return {key: [list(series[0]), series[1], series[2]] for key, series in self.values.items()}
+
+    # function to estimate a quantile from the buckets, it's the upper bound of the bucket the quantile falls in
+    def quantile(self, series: list, q: float) -> float:
+        counts, _, count = series
+        seen = 0
+        for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+            seen += bucket
+            if seen >= q * count:
+                return bound
+        return float("inf")
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in sorted(self.samples().items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self.formatLabels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.formatLabels(key)} {total}")
+            lines.append(f"{self.name}_count{self.formatLabels(key)} {count}")
+        return lines
+
+
+# function to time every call of an async function into a histogram
+def timed(histogram: Histogram, **labels):
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+
+        return wrapper
+
+    return decorate
+
+
+SEARCHER_LATENCY = Histogram("venus_searcher_seconds", "Time taken by VideoSearcher lookups, cache hits included", ("method",))
+SPOTIFY_LATENCY = Histogram("venus_spotify_request_seconds", "Time taken by Spotify API requests", ("status",))
+SPOTIFY_REFRESHES = Counter("venus_spotify_token_refreshes_total", "Spotify access tokens requested")
+EXTRACTION_WAIT = Histogram("venus_extraction_queue_wait_seconds", "Time yt-dlp lookups wait for a worker thread", ("priority",))
+FFMPEG_SPAWN = Histogram("venus_ffmpeg_spawn_seconds", "Time taken to start an FFmpeg audio source", ("mode",))
+PLAYBACK_GAP = Histogram("venus_playback_gap_seconds", "Silence between one song ending and the next one starting")
+DISCORD_SEND = Histogram("venus_discord_send_seconds", "Time taken by Discord message sends and edits", ("priority",))
+AUTOCOMPLETE_LATENCY = Histogram("venus_autocomplete_seconds", "Time taken to suggest songs while /play is typed")
+LINK_REFRESHES = Counter("venus_link_refreshes_total", "Stream links refreshed in the background before they expired", ("result",))
+CONTROLLER_EVICTIONS = Counter("venus_controller_evictions_total", "Idle music controllers let go of", ("reason",))
+QUEUE_DEPTH = Gauge("venus_queue_depth", "Songs queued per guild, the playing song included", ("guild",))
+
+
+# function to render every metric in the prometheus text format
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# function to sum up the histograms for people, (name, "count, average and p95 per label") for every one with data
+def summary() -> list:
+    result = []
+    for metric in registry:
+        if not isinstance(metric, Histogram):
+            continue
+        lines = []
+        for key, series in sorted(metric.samples().items()):
+            if not series[2]:
+                continue
+            label = "/".join(key) or "all"
+            lines.append(f"{label}: {series[2]} calls, avg {series[1] / series[2] * 1000:.0f}ms, p95 ≤{metric.quantile(series, 0.95) * 1000:.0f}ms")
+        if lines:
+            result.append((metric.description, "\n".join(lines)))
+    return result
+
+
+async def handleMetrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+# function to serve the metrics for prometheus, only when METRICS_PORT is set and only on localhost by default
+async def startMetricsServer():
+    global metricsRunner
+    port = os.getenv("METRICS_PORT")
+    if not port or metricsRunner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", handleMetrics)
+    metricsRunner = web.AppRunner(app, access_log=None)
+    await metricsRunner.setup()
+    host = os.getenv("METRICS_HOST", "127.0.0.1")
+    await web.TCPSite(metricsRunner, host, int(port)).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+
+async def stopMetricsServer():
+    global metricsRunner
+    if metricsRunner is not None:
+        await metricsRunner.cleanup()
+        metricsRunner = None
@@ -0,0 +1,159 @@
+import functools
+import re
+from urllib.parse import parse_qs, urlparse
+
+# host prefixes that point at the same site, music.youtube.com and m.youtube.com are plain youtube
+HOST_PREFIXES = ("www.", "m.", "music.", "open.")
+# a query is only treated as a link if it is one word that looks like a host and a path
+LINK_PATTERN = re.compile(r"^(https?://)?[\w.-]+\.[a-z]{2,}/\S*$", re.IGNORECASE)
+
+YOUTUBE_ID = re.compile(r"^[\w-]{6,}$")
+YOUTUBE_PATH = re.compile(r"^/(?:shorts|embed|live|v)/([\w-]+)")
+SPOTIFY_PATH = re.compile(r"^(?:/intl-[\w-]+)?/(track|playlist|album)/([a-zA-Z0-9]+)")
+SOUNDCLOUD_PATH = re.compile(r"^/([^/]+)/(sets/)?([^/]+)(/s-[\w-]+)?/?$")
+
+TRACK = "track"
+PLAYLIST = "playlist"
+
+
+class SourceMatch:
+    __slots__ = ("resolver", "kind", "id", "url")
+
+    def __init__(self, resolver, kind: str, id: str, url: str):
+        self.resolver = resolver
+        # TRACK or PLAYLIST
+        self.kind = kind
+        # the canonical id every form of the same link shares, e.g. youtube:dQw4w9WgXcQ
+        self.id = id
+        # a clean link rebuilt from the id, without timestamps, tracking params or mirror hosts
+        self.url = url
+
+    # function to get the name of the MusicController method that queues this link
+    def handler(self) -> str:
+        return self.resolver.playlistHandler if self.kind == PLAYLIST else self.resolver.handler
+
+
+class Resolver:
+    def __init__(self, name: str, hosts: tuple, classify, handler: str, playlistHandler: str):
+        self.name = name
+        self.hosts = hosts
+        # function taking the parsed link and returning (kind, id without the source prefix, clean url), or None
+        self.classify = classify
+        # MusicController methods that resolve a single song and flatten a playlist of this source
+        self.handler = handler
+        self.playlistHandler = playlistHandler
+
+
+def classifyYoutube(host: str, parsed) -> tuple | None:
+    query = parse_qs(parsed.query)
+    if host == "youtu.be":
+        video_id = parsed.path.strip("/").split("/")[0]
+    elif parsed.path.rstrip("/") == "/playlist" and query.get("list"):
+        playlist_id = query["list"][0]
+        return PLAYLIST, f"playlist:{playlist_id}", f"https://www.youtube.com/playlist?list={playlist_id}"
+    elif query.get("v"):
+        video_id = query["v"][0]
+    else:
+        match = YOUTUBE_PATH.match(parsed.path)
+        video_id = match.group(1) if match else None
+    if not video_id or not YOUTUBE_ID.match(video_id):
+        return None
+    return TRACK, video_id, f"https://www.youtube.com/watch?v={video_id}"
+
+
+def classifySpotify(host: str, parsed) -> tuple | None:
+    match = SPOTIFY_PATH.match(parsed.path)
+    if match is None:
+        return None
+    kind, spotify_id = match.groups()
+    return TRACK if kind == "track" else PLAYLIST, f"{kind}:{spotify_id}", f"https://open.spotify.com/{kind}/{spotify_id}"
+
+
+def classifySoundCloud(host: str, parsed) -> tuple | None:
+    match = SOUNDCLOUD_PATH.match(parsed.path)
+    if match is None:
+        return None
+    user, sets, name, secret = match.groups()
+    # private links carry a secret token, it's part of what identifies them
+    path = f"{user}/{sets or ''}{name}{secret or ''}"
+    return PLAYLIST if sets else TRACK, path, f"https://soundcloud.com/{path}"
+
+
+class ResolverRegistry:
+    def __init__(self):
+        self.resolvers = []
+        # host without www./m./music./open. -> the resolver for it, so a link is matched with one dict lookup
+        self.byHost = {}
+
+    def register(self, resolver: Resolver):
+        self.resolvers.append(resolver)
+        for host in resolver.hosts:
+            self.byHost[host] = resolver
+        # links looked up before this source existed may match differently now
+        matchSource.cache_clear()
+        canonicalId.cache_clear()
+
+    # function to parse a link into its host and url parts, None if the query isn't a link
+    def parse(self, query: str) -> tuple | None:
+        query = query.strip()
+        if not LINK_PATTERN.match(query):
+            return None
+        parsed = urlparse(query if "://" in query else f"https://{query}")
+        host = parsed.netloc.lower().split(":")[0]
+        for prefix in HOST_PREFIXES:
+            host = host.removeprefix(prefix)
+        return host, parsed
+
+    # function to find the resolver for a subdomain of one of the registered hosts
+    def bySuffix(self, host: str) -> Resolver | None:
+        for known, resolver in self.byHost.items():
+            if host.endswith(f".{known}"):
+                return resolver
+        return None
+
+    # function to find which source a /play query is for, None if it's a search or a link no source knows
+    def match(self, query: str) -> SourceMatch | None:
+        parts = self.parse(query)
+        if parts is None:
+            return None
+        host, parsed = parts
+        resolver = self.byHost.get(host)
+        if resolver is None:
+            # other subdomains (on.soundcloud.com share links, api.soundcloud.com, ...) are handed to yt-dlp as they are,
+            # their paths don't follow the layout the classifiers pick apart
+            resolver = self.bySuffix(host)
+            if resolver is None:
+                return None
+            return SourceMatch(resolver, TRACK, f"{resolver.name}:{host}{parsed.path.rstrip('/')}", query.strip())
+        classified = resolver.classify(host, parsed)
+        if classified is None:
+            # a link to the site we can't pick apart, hand it over as is and let yt-dlp make sense of it
+            return SourceMatch(resolver, TRACK, f"{resolver.name}:{host}{parsed.path.rstrip('/')}", query.strip())
+        kind, source_id, url = classified
+        return SourceMatch(resolver, kind, f"{resolver.name}:{source_id}", url)
+
+
+# function to find which source a /play query is for, None if it should be searched for instead
+@functools.lru_cache(maxsize=4096)
+def matchSource(query: str) -> SourceMatch | None:
+    return registry.match(query)
+
+
+# function to turn the many forms of the same link into one key, shared by the caches, the link store and lookups in flight
+@functools.lru_cache(maxsize=65536)
+def canonicalId(url: str) -> str:
+    match = registry.match(url)
+    if match is not None:
+        return match.id
+    # anything else is keyed by its URL without the query string (tracking params, timestamps, etc.)
+    parsed = urlparse(url.strip() if "://" in url else f"https://{url.strip()}")
+    host = parsed.netloc.lower()
+    for prefix in HOST_PREFIXES:
+        host = host.removeprefix(prefix)
+    return f"{host}{parsed.path.rstrip('/')}"
+
+
+registry = ResolverRegistry()
+registry.register(Resolver("youtube", ("youtube.com", "youtu.be"), classifyYoutube, "handleYoutubeLink", "handleYoutubePlaylist"))
+registry.register(Resolver("spotify", ("spotify.com",), classifySpotify, "handleSpotifyLink", "handleSpotifyPlaylist"))
+registry.register(Resolver("soundcloud", ("soundcloud.com",), classifySoundCloud, "handleSoundCloudLink", "handleSoundCloudPlaylist"))
@@ -0,0 +1,74 @@
+import asyncio
+
+
+class Call:
+    __slots__ = ("future", "tasks", "rank", "started")
+
+    def __init__(self, future: asyncio.Future):
+        # what every caller waits on, set by whichever run of the work finishes first
+        self.future = future
+        self.tasks = []
+        # how urgent the most urgent run is, higher is more urgent
+        self.rank = 0
+        # set once a run has actually begun, after that starting another one would only repeat the work
+        self.started = False
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+
+    # function to run func once per key, everyone asking for the same key while it runs shares the result.
+    # func is called with a function to call once the work really begins. A more urgent caller (higher rank) that joins
+    # while the work is still waiting its turn starts a run of its own, e.g. at its own priority, and everyone gets
+    # whichever run finishes first
+    async def do(self, key, func, rank: int = 0):
+        call = self.calls.get(key)
+        if call is None:
+            call = self.calls[key] = Call(asyncio.get_running_loop().create_future())
+            call.future.add_done_callback(lambda future: self.finished(key, call))
+            self.launch(call, func, rank)
+        elif rank > call.rank and not call.started:
+            self.launch(call, func, rank)
+        # shield the shared work so a caller being cancelled only stops that caller from waiting
+        return await asyncio.shield(call.future)
+
+    # function to start one run of the work for a call
+    def launch(self, call: Call, func, rank: int):
+        call.rank = rank
+
+        def markStarted():
+            call.started = True
+
+        task = asyncio.create_task(func(markStarted))
+        call.tasks.append(task)
+        task.add_done_callback(lambda done: self.runFinished(call, done))
+
+    # function to hand a finished run's result to the callers, a failed run only counts if no other run is left
+    def runFinished(self, call: Call, task: asyncio.Task):
+        call.tasks.remove(task)
+        error = None if task.cancelled() else task.exception()
+        if call.future.done():
+            return
+        if not task.cancelled() and error is None:
+            call.future.set_result(task.result())
+            # the runs still waiting for their turn aren't needed anymore
+            for other in call.tasks:
+                other.cancel()
+        elif not call.tasks:
+            if error is not None:
+                call.future.set_exception(error)
+            else:
+                call.future.cancel()
+
+    # function to clear a finished call out of the table
+    def finished(self, key, call: Call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        # mark the exception as seen in case every caller was cancelled before it finished
+        if not call.future.cancelled():
+            call.future.exception()
+
+    # function to get how many lookups are currently shared
+    def __len__(self):
+        return len(self.calls)
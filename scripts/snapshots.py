@@ -0,0 +1,106 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+
+# bumped whenever the layout changes, older snapshots are ignored instead of restored wrong
+SNAPSHOT_VERSION = 1
+
+snapshotStore = None
+
+
+class SnapshotStore:
+    def __init__(self, path: Path, interval: float = 5):
+        self.path = Path(path)
+        # how often the controllers are checked for changes, in seconds
+        self.interval = interval
+        # guild id -> snapshot from the last run that hasn't been restored yet
+        self.pending = self.load()
+        # guild id -> (state signature, encoded snapshot), so only guilds that changed get encoded again
+        self.fragments = {}
+        self.task = None
+        self.saves = 0
+
+    # function to read the snapshots the last run left behind
+    def load(self) -> dict:
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unable to read queue snapshots from {self.path}: {e}")
+            return {}
+        if data.get("version") != SNAPSHOT_VERSION:
+            logging.info(f"Ignoring queue snapshots from version {data.get('version')}")
+            return {}
+        snapshots = {int(guild_id): snapshot for guild_id, snapshot in data.get("guilds", {}).items()}
+        logging.info(f"Loaded queue snapshots for {len(snapshots)} guilds")
+        return snapshots
+
+    # function to start checking the controllers for changes in the background
+    def start(self, controllers: dict):
+        if self.task is None:
+            self.task = asyncio.create_task(self.watch(controllers))
+
+    async def watch(self, controllers: dict):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save(controllers)
+            except Exception as e:
+                logging.error(f"Unable to save queue snapshots: {e}")
+
+    # function to write every controller's state to disk, skipped if nothing changed since the last save
+    async def save(self, controllers: dict) -> bool:
+        fragments = {}
+        changed = False
+        for guild_id, controller in list(controllers.items()):
+            signature = controller.snapshotSignature()
+            # controllers without a channel have nothing worth restoring
+            if signature is None:
+                continue
+            fragment = self.fragments.get(guild_id)
+            if fragment is None or fragment[0] != signature:
+                fragment = (signature, json.dumps(controller.toSnapshot(), separators=(",", ":")))
+                changed = True
+            fragments[guild_id] = fragment
+        changed = changed or fragments.keys() != self.fragments.keys()
+        self.fragments = fragments
+        if not changed:
+            return False
+
+        # guilds that haven't been restored yet (e.g. still unavailable) keep their old snapshot
+        encoded = {guild_id: fragment for guild_id, (_, fragment) in fragments.items()}
+        for guild_id, snapshot in self.pending.items():
+            encoded.setdefault(guild_id, json.dumps(snapshot, separators=(",", ":")))
+        body = ",".join(f'"{guild_id}":{fragment}' for guild_id, fragment in encoded.items())
+        text = f'{{"version":{SNAPSHOT_VERSION},"guilds":{{{body}}}}}'
+        await asyncio.to_thread(self.write, text)
+        self.saves += 1
+        return True
+
+    # function to compress and swap in the new snapshot file, so a crash mid-write never leaves half a file behind
+    def write(self, text: str):
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=5) as file:
+            file.write(text)
+        os.replace(temp_path, self.path)
+
+    # function to save one last time and stop watching, used when the bot shuts down
+    async def close(self, controllers: dict):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.save(controllers)
+
+
+def getSnapshotStore() -> SnapshotStore:
+    global snapshotStore
+    if snapshotStore is None:
+        root_dir = Path(__file__).resolve().parent.parent
+        path = os.getenv("SNAPSHOT_PATH") or root_dir / "queue_snapshots.json.gz"
+        snapshotStore = SnapshotStore(path, max(1, float(os.getenv("SNAPSHOT_INTERVAL", 5))))
+    return snapshotStore
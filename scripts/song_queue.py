@@ -0,0 +1,347 @@
+import itertools
+import random
+from collections import deque
+
+
+# function to get how long a song is, songs without a known duration (like live streams) count as 0
+def songDuration(song) -> int:
+    return song.duration or 0
+
+
+class SongQueue:
+    # songs per block, small enough that work inside one block is cheap and large enough to keep the block count low
+    LOAD = 256
+    # how far from its last known position indexOf looks for a song before searching the whole queue
+    NEARBY = 32
+
+    def __init__(self, songs=()):
+        # bumped on every change, so views can tell if the queue moved underneath them
+        self.version = 0
+        self.rebuild(list(songs))
+
+    # function to lay the songs out in fresh blocks and rebuild the index over them
+    def rebuild(self, songs: list):
+        self.blocks = [deque(songs[i : i + self.LOAD]) for i in range(0, len(songs), self.LOAD)]
+        self.length = len(songs)
+        # each block's titles lower cased and joined, built when the queue is first searched and reset to None when songs
+        # are added to or moved into the block. Songs taken out can stay in it, every hit is checked against the song
+        self.blockTitles = [None] * len(self.blocks)
+        self.buildIndex()
+
+    # function to build the fenwick trees over block lengths and block durations, the first finds the block holding
+    # a position in O(log n) and the second sums the durations in front of it, e.g. for when a song will play
+    def buildIndex(self):
+        self.tree = self.buildTree([len(block) for block in self.blocks])
+        self.times = self.buildTree([sum(map(songDuration, block)) for block in self.blocks])
+        # songs (and their seconds) popped off the front since the index was last touched, so popping the head stays O(1)
+        self.headShift = 0
+        self.headTime = 0
+
+    @staticmethod
+    def buildTree(values: list) -> list:
+        tree = [0] * (len(values) + 1)
+        for i, value in enumerate(values, start=1):
+            tree[i] += value
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        return tree
+
+    # function to add delta to one block's entry in a fenwick tree
+    @staticmethod
+    def updateTree(tree: list, blockIndex: int, delta: int):
+        i = blockIndex + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    # function to sum the first count blocks' entries in a fenwick tree
+    @staticmethod
+    def prefixTree(tree: list, count: int) -> int:
+        total = 0
+        while count > 0:
+            total += tree[count]
+            count -= count & -count
+        return total
+
+    # function to add a song's length and duration to (or with -1, take them off) one block in the index
+    def updateIndex(self, blockIndex: int, delta: int, song=None):
+        self.updateTree(self.tree, blockIndex, delta)
+        if song is not None and song.duration:
+            self.updateTree(self.times, blockIndex, delta * song.duration)
+
+    # function to sum the indexed lengths of the first count blocks
+    def prefix(self, count: int) -> int:
+        return self.prefixTree(self.tree, count)
+
+    # function to fold the songs popped off the front back into the index before the first block changes
+    def flushHead(self):
+        if self.headShift:
+            self.updateTree(self.tree, 0, -self.headShift)
+            self.updateTree(self.times, 0, -self.headTime)
+            self.headShift = 0
+            self.headTime = 0
+
+    # function to turn a queue position into (block index, position inside that block)
+    def locate(self, index: int) -> tuple:
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("queue index out of range")
+        # the index still counts the popped songs as part of the first block, so search as if they were there
+        position = index + self.headShift
+        blockIndex = 0
+        step = 1 << (len(self.blocks).bit_length() - 1)
+        while step:
+            if blockIndex + step <= len(self.blocks) and self.tree[blockIndex + step] <= position:
+                blockIndex += step
+                position -= self.tree[blockIndex]
+            step >>= 1
+        if blockIndex == 0:
+            position -= self.headShift
+        return blockIndex, position
+
+    # function to add a block to the end of the index without rebuilding it
+    def appendBlock(self, block: deque):
+        self.blocks.append(block)
+        self.blockTitles.append(None)
+        i = len(self.blocks)
+        self.tree.append(len(block) + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+        seconds = sum(map(songDuration, block))
+        self.times.append(seconds + self.prefixTree(self.times, i - 1) - self.prefixTree(self.times, i - (i & -i)))
+
+    def append(self, song):
+        if not self.blocks or len(self.blocks[-1]) >= self.LOAD:
+            self.appendBlock(deque([song]))
+        else:
+            self.blocks[-1].append(song)
+            self.blockTitles[-1] = None
+            self.updateIndex(len(self.blocks) - 1, 1, song)
+        self.length += 1
+        self.version += 1
+
+    def extend(self, songs):
+        for song in songs:
+            self.append(song)
+
+    # function to take the song off the front of the queue
+    def popleft(self):
+        if not self.length:
+            raise IndexError("pop from an empty queue")
+        song = self.blocks[0].popleft()
+        self.length -= 1
+        self.version += 1
+        if self.blocks[0]:
+            self.headShift += 1
+            self.headTime += songDuration(song)
+        else:
+            # dropping the first block shifts every other block, which only happens once every LOAD pops
+            del self.blocks[0]
+            del self.blockTitles[0]
+            self.buildIndex()
+        return song
+
+    def pop(self, index: int = -1):
+        blockIndex, position = self.locate(index)
+        if blockIndex == 0 and position == 0:
+            return self.popleft()
+        if blockIndex == 0:
+            self.flushHead()
+        block = self.blocks[blockIndex]
+        song = block[position]
+        del block[position]
+        self.length -= 1
+        self.version += 1
+        if block:
+            self.updateIndex(blockIndex, -1, song)
+        else:
+            del self.blocks[blockIndex]
+            del self.blockTitles[blockIndex]
+            self.buildIndex()
+        return song
+
+    def insert(self, index: int, song):
+        if index < 0:
+            index = max(0, index + self.length)
+        if index >= self.length:
+            self.append(song)
+            return
+        blockIndex, position = self.locate(index)
+        if blockIndex == 0:
+            self.flushHead()
+        block = self.blocks[blockIndex]
+        block.insert(position, song)
+        self.blockTitles[blockIndex] = None
+        self.length += 1
+        self.version += 1
+        if len(block) > self.LOAD * 2:
+            # split blocks that grew too big, so inserting into one stays cheap
+            self.blocks[blockIndex : blockIndex + 1] = [deque(itertools.islice(block, 0, self.LOAD)), deque(itertools.islice(block, self.LOAD, None))]
+            self.blockTitles[blockIndex : blockIndex + 1] = [None, None]
+            self.buildIndex()
+        else:
+            self.updateIndex(blockIndex, 1, song)
+
+    # function to move the song at one position to another
+    def move(self, from_index: int, to_index: int):
+        self.insert(to_index, self.pop(from_index))
+
+    # function to shuffle every song after the first start songs, inside the blocks they're already in
+    def shuffleTail(self, start: int = 1):
+        if start >= self.length - 1:
+            return
+        blockIndex, position = self.locate(start)
+        songs = list(self.iterFrom(start))
+        random.shuffle(songs)
+        # every block keeps its size, so only the songs move and the length tree stays as it is
+        self.flushHead()
+        first = self.blocks[blockIndex]
+        taken = len(first) - position
+        for _ in range(taken):
+            first.pop()
+        first.extend(songs[:taken])
+        for block in itertools.islice(self.blocks, blockIndex + 1, None):
+            size = len(block)
+            block.clear()
+            block.extend(songs[taken : taken + size])
+            taken += size
+        self.blockTitles[blockIndex:] = [None] * (len(self.blocks) - blockIndex)
+        # which block a second of music is in did change, so the duration tree is rebuilt
+        self.times = self.buildTree([sum(map(songDuration, block)) for block in self.blocks])
+        self.version += 1
+
+    # function to change how long a song is, through the queue so its duration index stays right
+    def setDuration(self, song, duration: int, hint: int = None):
+        try:
+            blockIndex, position = self.locate(self.indexOf(song, hint))
+        except ValueError:
+            song.duration = duration
+            return
+        if blockIndex == 0:
+            self.flushHead()
+        self.updateTree(self.times, blockIndex, (duration or 0) - songDuration(song))
+        song.duration = duration
+
+    # function to change a song's title, through the queue so a search of its block sees the new one
+    def setTitle(self, song, title: str, hint: int = None):
+        if song.title == title:
+            return
+        song.title = title
+        try:
+            blockIndex = self.locate(self.indexOf(song, hint))[0]
+        except ValueError:
+            return
+        self.blockTitles[blockIndex] = None
+
+    # function to get the total duration of the songs in front of a position, e.g. how long until it plays
+    def durationBefore(self, index: int) -> int:
+        if index >= self.length:
+            return self.totalDuration()
+        if index <= 0:
+            return 0
+        blockIndex, position = self.locate(index)
+        before = self.prefixTree(self.times, blockIndex) - (self.headTime if blockIndex else 0)
+        return before + sum(map(songDuration, itertools.islice(self.blocks[blockIndex], position)))
+
+    # function to get the total duration of every song in the queue
+    def totalDuration(self) -> int:
+        return self.prefixTree(self.times, len(self.blocks)) - self.headTime
+
+    def clear(self):
+        self.rebuild([])
+        self.version += 1
+
+    def index(self, song) -> int:
+        for i, queued in enumerate(self):
+            if queued is song or queued == song:
+                return i
+        raise ValueError("song is not in the queue")
+
+    # function to find where a song is now, looking around where it last was first, since the queue usually only
+    # shifts by the few songs that finished in the meantime
+    def indexOf(self, song, hint: int = None) -> int:
+        if hint is not None and self.length:
+            start = max(0, min(hint, self.length - 1) - self.NEARBY)
+            for i, queued in enumerate(itertools.islice(self.iterFrom(start), self.NEARBY * 2 + 1), start=start):
+                if queued is song:
+                    return i
+        for i, queued in enumerate(self):
+            if queued is song:
+                return i
+        raise ValueError("song is not in the queue")
+
+    # function to find the songs whose title contains the text, as (position, song) in queue order. Each block is
+    # checked with one substring search over its joined titles, and only the blocks that hit are looked at song by song
+    def search(self, text: str, limit: int = 25) -> list:
+        text = text.lower()
+        matches = []
+        offset = 0
+        for blockIndex, block in enumerate(self.blocks):
+            titles = self.blockTitles[blockIndex]
+            if titles is None:
+                titles = self.blockTitles[blockIndex] = "\n".join(song.title for song in block).lower()
+            if text in titles:
+                for i, song in enumerate(block, start=offset):
+                    if text in song.title.lower():
+                        matches.append((i, song))
+                        if len(matches) >= limit:
+                            return matches
+            offset += len(block)
+        return matches
+
+    def remove(self, song):
+        self.pop(self.index(song))
+
+    # function to walk the queue from a position without building the whole list
+    def iterFrom(self, start: int):
+        if start >= self.length:
+            return iter(())
+        blockIndex, position = self.locate(start)
+        first = itertools.islice(self.blocks[blockIndex], position, None)
+        # the later blocks are only touched as they're reached, so reading a page costs the same however long the queue is
+        rest = (self.blocks[i] for i in range(blockIndex + 1, len(self.blocks)))
+        return itertools.chain(first, itertools.chain.from_iterable(rest))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return list(self)[index]
+            return list(itertools.islice(self.iterFrom(start), max(0, stop - start)))
+        blockIndex, position = self.locate(index)
+        return self.blocks[blockIndex][position]
+
+    def __setitem__(self, index, song):
+        if isinstance(index, slice):
+            songs = list(self)
+            songs[index] = song
+            self.rebuild(songs)
+        else:
+            blockIndex, position = self.locate(index)
+            if blockIndex == 0:
+                self.flushHead()
+            self.updateTree(self.times, blockIndex, songDuration(song) - songDuration(self.blocks[blockIndex][position]))
+            self.blocks[blockIndex][position] = song
+            self.blockTitles[blockIndex] = None
+        self.version += 1
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            songs = list(self)
+            del songs[index]
+            self.rebuild(songs)
+            self.version += 1
+        else:
+            self.pop(index)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.blocks)
+
+    def __contains__(self, song):
+        return any(queued is song or queued == song for queued in self)
+
+    def __repr__(self):
+        return f"SongQueue({self.length} songs, version {self.version})"
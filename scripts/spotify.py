@@ -1,20 +1,65 @@
+import asyncio
 import logging
 import os
-import re
+import time
 from pathlib import Path
 
 import aiohttp
 from dotenv import load_dotenv
 
+from scripts.metrics import SPOTIFY_LATENCY, SPOTIFY_REFRESHES
+from scripts.resolvers import matchSource
+
+# defaults for SPOTIFY_API_URL and SPOTIFY_TOKEN_URL, which can point the bot at a stand-in server (see benchmarks/)
+API_URL = "https://api.spotify.com/v1"
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+# the most items spotify hands back per page / per batch request
+PLAYLIST_PAGE_SIZE = 100
+ALBUM_PAGE_SIZE = 50
+TRACK_BATCH_SIZE = 50
+# only ask spotify for the fields we actually use, which keeps large playlist pages small
+PLAYLIST_TRACK_FIELDS = "items(track(id,name,artists(name))),next,total,limit"
+PLAYLIST_FIELDS = f"name,images,tracks({PLAYLIST_TRACK_FIELDS})"
+
+session = None
+tokenManager = None
+spotifyController = None
+
+
+# function to get the aiohttp session shared by every spotify request, so connections stay alive between calls
+def getSession() -> aiohttp.ClientSession:
+    global session
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=int(os.getenv("SPOTIFY_CONNECTION_LIMIT", 10)), keepalive_timeout=60)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+    return session
+
+
+# function to close the shared session when the bot shuts down
+async def closeSession():
+    global session
+    if tokenManager is not None:
+        tokenManager.close()
+    if session is not None and not session.closed:
+        await session.close()
+    session = None
+
+
+class SpotifyTokenManager:
+    # refresh this many seconds before spotify says the token expires
+    REFRESH_MARGIN = 60
 
-class SpotifyController:
     def __init__(self):
         load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env")
         self.__client_id = os.getenv("SPOTIFY_CLIENT_ID")
         self.__client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
         self.__refresh_token = os.getenv("SPOTIFY_CLIENT_REFRESH_TOKEN")
-        self.__token_url = "https://accounts.spotify.com/api/token"
+        self.__token_url = os.getenv("SPOTIFY_TOKEN_URL", TOKEN_URL)
         self.__access_token = None
+        self.expires_at = 0
+        self.refresh_count = 0
+        self.refresh_task = None
+        self.refresh_timer = None
 
     def __get_payload(self):
         return {
@@ -24,101 +69,215 @@ class SpotifyController:
             "client_secret": self.__client_secret,
         }
 
-    async def refresh_token(self):
+    # function to check if the current token can still be used
+    def isValid(self) -> bool:
+        return self.__access_token is not None and time.monotonic() < self.expires_at - self.REFRESH_MARGIN
+
+    async def get_access_token(self):
+        if self.isValid():
+            return self.__access_token
+        return await self.refresh_token()
+
+    # function to refresh the token, every caller that asks while a refresh is running shares that one request
+    async def refresh_token(self, stale_token: str = None):
+        # someone else already swapped out the token that was rejected
+        if stale_token is not None and stale_token != self.__access_token and self.isValid():
+            return self.__access_token
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self.requestToken())
+        # shield the shared request so one caller being cancelled doesn't cancel it for everyone
+        return await asyncio.shield(self.refresh_task)
+
+    async def requestToken(self):
         payload = self.__get_payload()
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.__token_url, data=payload) as response:
-                if response.status == 200:
-                    logging.debug("Successfully refreshed spotify token.")
-                    data = await response.json()
-                    self.__access_token = data["access_token"]
-                    return self.__access_token
-                else:
-                    text = await response.text()
-                    logging.debug(f"Failed to refresh token: {response.status} - {text}")
-                    return None
+        self.refresh_count += 1
+        SPOTIFY_REFRESHES.inc()
+        async with getSession().post(self.__token_url, data=payload) as response:
+            if response.status == 200:
+                logging.debug("Successfully refreshed spotify token.")
+                data = await response.json()
+                self.__access_token = data["access_token"]
+                self.expires_at = time.monotonic() + int(data.get("expires_in", 3600))
+                self.scheduleRefresh()
+                return self.__access_token
+            else:
+                text = await response.text()
+                logging.debug(f"Failed to refresh token: {response.status} - {text}")
+                return None
+
+    # function to refresh the token in the background shortly before it expires
+    def scheduleRefresh(self):
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+        delay = max(0, self.expires_at - self.REFRESH_MARGIN - time.monotonic())
+
+        def refresh_in_background():
+            self.refresh_timer = None
+            if self.refresh_task is None or self.refresh_task.done():
+                self.refresh_task = asyncio.create_task(self.requestToken())
+                self.refresh_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        self.refresh_timer = asyncio.get_running_loop().call_later(delay, refresh_in_background)
+
+    # function to stop the background refresh when the bot shuts down
+    def close(self):
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+            self.refresh_timer = None
+
+
+class SpotifyController:
+    def __init__(self):
+        self.tokens = getTokenManager()
+        self.api_url = os.getenv("SPOTIFY_API_URL", API_URL).rstrip("/")
+        # how many playlist pages are fetched at once
+        self.page_concurrency = max(1, int(os.getenv("SPOTIFY_PAGE_CONCURRENCY", 4)))
+
+    async def refresh_token(self):
+        return await self.tokens.refresh_token()
 
     async def get_access_token(self):
-        if self.__access_token is None:
-            return await self.refresh_token()
-        return self.__access_token
+        return await self.tokens.get_access_token()
+
+    # function to GET a spotify API endpoint, refreshing the token once if the request is rejected
+    async def apiGet(self, url: str, params: dict = None) -> dict | None:
+        access_token = await self.get_access_token()
+        refreshed = False
+        for _ in range(4):
+            headers = {"Authorization": f"Bearer {access_token}"}
+            start = time.perf_counter()
+            async with getSession().get(url, headers=headers, params=params) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    SPOTIFY_LATENCY.observe(time.perf_counter() - start, status=resp.status)
+                    return data
+                SPOTIFY_LATENCY.observe(time.perf_counter() - start, status=resp.status)
+                if resp.status == 429:
+                    # rate limited, wait as long as spotify asks before trying again
+                    retry_after = int(resp.headers.get("Retry-After", 1))
+                    logging.warning(f"Spotify rate limited, retrying in {retry_after}s")
+                    await asyncio.sleep(retry_after)
+                    continue
+                logging.debug(f"Spotify request to {url} failed: {resp.status}")
+            if refreshed or resp.status != 401:
+                return None
+            access_token = await self.tokens.refresh_token(stale_token=access_token)
+            refreshed = True
+        return None
+
+    # function to split a spotify link into its kind (track, playlist or album) and id, using the resolver registry
+    def parseUrl(self, spotify_url: str) -> tuple:
+        source = matchSource(spotify_url)
+        if source is None or source.resolver.name != "spotify" or source.id.count(":") != 2:
+            return None, None
+        _, kind, spotify_id = source.id.split(":")
+        return kind, spotify_id
 
     def extract_track_id(self, spotify_url: str) -> str:
-        match = re.search(r"spotify\.com/track/([a-zA-Z0-9]+)", spotify_url)
-        if match:
-            return match.group(1)
+        kind, track_id = self.parseUrl(spotify_url)
+        if kind == "track":
+            return track_id
         else:
             raise ValueError("Invalid Spotify track URL")
 
+    # function to turn a spotify track object into the info we need to search for it
+    def trackInfo(self, track: dict) -> dict:
+        return {"id": track.get("id"), "title": track["name"], "artist": track["artists"][0]["name"]}
+
     async def getSpotifySongInfo(self, spotify_url: str) -> dict:
         track_id = self.extract_track_id(spotify_url)
-        api_url = f"https://api.spotify.com/v1/tracks/{track_id}"
-
-        async with aiohttp.ClientSession() as session:
-            access_token = await self.get_access_token()
-            headers = {"Authorization": f"Bearer {access_token}"}
-            logging.debug(f"access token: {self.__access_token}")
-
-            async def fetch_track() -> dict:
-                async with session.get(api_url, headers=headers) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        return {"title": data["name"], "artist": data["artists"][0]["name"]}
-                    return None
-
-            result = await fetch_track()
-            if result is not None:
-                return result
+        result = await self.getSpotifySongsInfo([track_id])
+        if result:
+            return result[0]
+        else:
+            raise Exception("Failed to fetch track info.")
 
-            # If first attempt fails, try to refresh token
-            access_token = await self.refresh_token()
-            headers = {"Authorization": f"Bearer {access_token}"}
-            result = await fetch_track()
+    # function to look up many tracks at once using spotify's multi-ID endpoint
+    async def getSpotifySongsInfo(self, track_ids: list) -> list:
+        batches = [track_ids[i : i + TRACK_BATCH_SIZE] for i in range(0, len(track_ids), TRACK_BATCH_SIZE)]
+        semaphore = asyncio.Semaphore(self.page_concurrency)
 
-            if result is not None:
-                return result
-            else:
+        async def fetch_batch(batch):
+            async with semaphore:
+                data = await self.apiGet(f"{self.api_url}/tracks", params={"ids": ",".join(batch)})
+            if data is None:
                 raise Exception("Failed to fetch track info.")
+            return [self.trackInfo(track) for track in data.get("tracks", []) if track]
+
+        results = await asyncio.gather(*(fetch_batch(batch) for batch in batches))
+        return [track for batch in results for track in batch]
 
     async def getSpotifyPlaylistInfo(self, spotify_url: str) -> list:
-        playlist_match = re.search(r"spotify\.com/playlist/([a-zA-Z0-9]+)", spotify_url)
-        album_match = re.search(r"spotify\.com/album/([a-zA-Z0-9]+)", spotify_url)
+        kind, spotify_id = self.parseUrl(spotify_url)
+        is_playlist = kind == "playlist"
 
-        if playlist_match:
-            endpoint = f"https://api.spotify.com/v1/playlists/{playlist_match.group(1)}"
-        elif album_match:
-            endpoint = f"https://api.spotify.com/v1/albums/{album_match.group(1)}"
+        if is_playlist:
+            endpoint = f"{self.api_url}/playlists/{spotify_id}"
+            params = {"fields": PLAYLIST_FIELDS}
+            page_params = {"fields": PLAYLIST_TRACK_FIELDS}
+            page_size = PLAYLIST_PAGE_SIZE
+        elif kind == "album":
+            endpoint = f"{self.api_url}/albums/{spotify_id}"
+            params = None
+            page_params = {}
+            page_size = ALBUM_PAGE_SIZE
         else:
             raise ValueError("Invalid Spotify playlist or album URL")
 
-        async with aiohttp.ClientSession() as session:
-            access_token = await self.get_access_token()
-            headers = {"Authorization": f"Bearer {access_token}"}
+        # the first request gets the name, the cover and the first page of tracks
+        data = await self.apiGet(endpoint, params=params)
+        if data is None:
+            raise Exception("Failed to fetch playlist/album info.")
+        title = data.get("name")
+        thumbnail = data["images"][0]["url"] if data.get("images") else None
+        first_page = data.get("tracks", {})
+        pages = [first_page]
 
-            async def fetch_items():
-                async with session.get(endpoint, headers=headers) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        title = data.get("name")
-                        thumbnail = data["images"][0]["url"] if data.get("images") else None
-                        items = data.get("tracks", {}).get("items", []) if "playlist" in endpoint else data.get("tracks", {}).get("items", [])
-                        track_list = [
-                            {"title": item["track"]["name"] if "playlist" in endpoint else item["name"], "artist": item["track"]["artists"][0]["name"] if "playlist" in endpoint else item["artists"][0]["name"]}
-                            for item in items
-                            if item.get("track") or item.get("name")
-                        ]
-                        return [{"title": title, "thumbnail": thumbnail}] + track_list
-                    return None
-
-            result = await fetch_items()
-            if result is not None:
-                return result
-
-            access_token = await self.refresh_token()
-            headers = {"Authorization": f"Bearer {access_token}"}
-            result = await fetch_items()
+        total = first_page.get("total")
+        if total is not None:
+            # we know how many tracks there are, so fetch every remaining page at once
+            semaphore = asyncio.Semaphore(self.page_concurrency)
 
-            if result is not None:
-                return result
-            else:
-                raise Exception("Failed to fetch playlist/album info.")
+            async def fetch_page(offset):
+                async with semaphore:
+                    page = await self.apiGet(f"{endpoint}/tracks", params={**page_params, "offset": offset, "limit": page_size})
+                if page is None:
+                    raise Exception("Failed to fetch playlist/album info.")
+                return page
+
+            offsets = range(len(first_page.get("items", [])), total, page_size)
+            pages += await asyncio.gather(*(fetch_page(offset) for offset in offsets))
+        else:
+            # otherwise just follow the next links one page at a time
+            next_url = first_page.get("next")
+            while next_url:
+                page = await self.apiGet(next_url)
+                if page is None:
+                    raise Exception("Failed to fetch playlist/album info.")
+                pages.append(page)
+                next_url = page.get("next")
+
+        track_list = []
+        for page in pages:
+            for item in page.get("items", []):
+                # playlist items wrap the track, album items are the track, removed/local tracks come back empty
+                track = item.get("track") if is_playlist else item
+                if track and track.get("name") and track.get("artists"):
+                    track_list.append(self.trackInfo(track))
+        return [{"title": title, "thumbnail": thumbnail}] + track_list
+
+
+# function to get the token manager shared by the whole process
+def getTokenManager() -> SpotifyTokenManager:
+    global tokenManager
+    if tokenManager is None:
+        tokenManager = SpotifyTokenManager()
+    return tokenManager
+
+
+# function to get the spotify controller shared by every guild
+def getSpotifyController() -> SpotifyController:
+    global spotifyController
+    if spotifyController is None:
+        spotifyController = SpotifyController()
+    return spotifyController
@@ -0,0 +1,155 @@
+import array
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import re
+import time
+
+from scripts.cache import getMetadataCache
+from scripts.metrics import AUTOCOMPLETE_LATENCY
+
+# how long new titles wait before they're written to the metadata cache, so a playlist is saved in one go
+SAVE_DELAY = 5
+# titles indexed between yields to the event loop while the index is loaded at startup
+LOAD_BATCH = 2000
+# at most this many songs are scored per keystroke, taken from the rarest trigrams of the query
+MAX_CANDIDATES = 2000
+# a song needs at least this share of the query's trigrams to be suggested
+MIN_SCORE = 0.5
+NON_WORD = re.compile(r"[^\w\s]+")
+
+titleIndex = None
+
+
+# function to lower case a title and strip punctuation, so "Don't Stop" and "dont stop" look the same
+def normalizeTitle(title: str) -> list:
+    return NON_WORD.sub("", title.lower()).split()
+
+
+# function to get the trigrams of a title, every word is padded so the start and end of words count too
+def titleTrigrams(title: str) -> set:
+    grams = set()
+    for word in normalizeTitle(title):
+        padded = f" {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+# function to get the trigrams of what's been typed so far, the last word may not be finished so its end isn't padded
+def queryTrigrams(query: str) -> set:
+    words = normalizeTitle(query)
+    grams = set()
+    for i, word in enumerate(words):
+        padded = f" {word} " if i < len(words) - 1 or query.endswith(" ") else f" {word}"
+        grams.update(padded[j : j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+class TitleIndex:
+    def __init__(self):
+        self.cache = getMetadataCache()
+        # song number -> (title, url, duration)
+        self.songs = []
+        # canonical id -> song number, so the same song is only indexed once
+        self.ids = {}
+        # trigram -> numbers of the songs whose title has it, compact arrays since there are millions of them
+        self.postings = {}
+        # canonical id -> (key, title, url, duration) not written to the metadata cache yet
+        self.unsaved = {}
+        self.saveTimer = None
+        self.loaded = False
+
+    # function to load every title the metadata cache knows, a batch at a time so the bot stays responsive
+    async def load(self):
+        start = time.perf_counter()
+        rows = self.cache.loadTitles()
+        for i in range(0, len(rows), LOAD_BATCH):
+            for key, title, url, duration in rows[i : i + LOAD_BATCH]:
+                self.insert(key, title, url, duration)
+            await asyncio.sleep(0)
+        self.loaded = True
+        logging.info(f"Indexed {len(self.songs)} song titles for /play suggestions in {time.perf_counter() - start:.2f}s")
+
+    def insert(self, key: str, title: str, url: str, duration: int):
+        number = self.ids.get(key)
+        if number is not None:
+            old_title = self.songs[number][0]
+            self.songs[number] = (title, url, duration)
+            if old_title == title:
+                return
+            # the title changed, so move the song to the new title's trigrams
+            for gram in titleTrigrams(old_title):
+                self.postings[gram].remove(number)
+        else:
+            number = self.ids[key] = len(self.songs)
+            self.songs.append((title, url, duration))
+        for gram in titleTrigrams(title):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array.array("I")
+            postings.append(number)
+
+    # function to add a song that was just queued, it's saved to the metadata cache shortly after
+    def add(self, key: str, title: str, url: str, duration: int):
+        if not title or not url:
+            return
+        self.insert(key, title, url, duration)
+        self.unsaved[key] = (key, title, url, duration)
+        if self.saveTimer is None:
+            self.saveTimer = asyncio.get_running_loop().call_later(SAVE_DELAY, self.save)
+
+    def save(self):
+        self.saveTimer = None
+        if not self.unsaved:
+            return
+        rows, self.unsaved = list(self.unsaved.values()), {}
+        try:
+            self.cache.putTitles(rows)
+        except Exception as e:
+            logging.warning(f"Unable to save {len(rows)} song titles: {e}")
+
+    # function to find the songs whose titles best match what's been typed, as (title, url, duration)
+    def search(self, query: str, limit: int = 25) -> list:
+        start = time.perf_counter()
+        grams = queryTrigrams(query)
+        lists = sorted((self.postings[gram] for gram in grams if self.postings.get(gram)), key=len)
+        if not lists:
+            return []
+        # only songs that share one of the rarest trigrams can score well, so those are the only ones scored
+        candidates = set()
+        for postings in lists:
+            candidates.update(itertools.islice(postings, MAX_CANDIDATES - len(candidates)))
+            if len(candidates) >= MAX_CANDIDATES // 4:
+                break
+        # count how many of the query's trigrams each candidate has, the intersections run in C
+        hits = collections.Counter()
+        for postings in lists:
+            hits.update(candidates.intersection(postings))
+        scored = []
+        for number, count in hits.items():
+            score = count / len(grams)
+            if score >= MIN_SCORE:
+                # better matches first, then shorter titles, then the songs indexed most recently
+                scored.append((-score, len(self.songs[number][0]), -number))
+        results = [self.songs[-entry[2]] for entry in heapq.nsmallest(limit, scored)]
+        AUTOCOMPLETE_LATENCY.observe(time.perf_counter() - start)
+        return results
+
+    # function to write the titles that are still waiting when the bot shuts down
+    def close(self):
+        if self.saveTimer is not None:
+            self.saveTimer.cancel()
+        self.save()
+
+    def __len__(self):
+        return len(self.songs)
+
+
+# function to get the title index shared by every guild
+def getTitleIndex() -> TitleIndex:
+    global titleIndex
+    if titleIndex is None:
+        titleIndex = TitleIndex()
+    return titleIndex
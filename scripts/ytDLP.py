@@ -1,10 +1,43 @@
-import asyncio
 import re
+import threading
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
 from yt_dlp import YoutubeDL
 
+from scripts.cache import getMetadataCache, normalizeQuery
+from scripts.extraction_scheduler import INTERACTIVE, PRIORITY_RANKS, getExtractionScheduler
+from scripts.metrics import SEARCHER_LATENCY, timed
+from scripts.resolvers import canonicalId
+from scripts.singleflight import SingleFlight
+
+# yt-dlp options for every kind of lookup, the cookies file is added per instance
+PROFILES = {
+    "single": {"format": "bestaudio/best", "quiet": True, "noplaylist": True, "cachedir": False},
+    "search": {"format": "bestaudio/best", "quiet": True, "noplaylist": True, "cachedir": False, "default_search": "ytsearch", "max_downloads": 1},
+    "flat_search": {"format": "bestaudio/best", "quiet": True, "noplaylist": True, "cachedir": False, "default_search": "ytsearch10", "ignoreerrors": True, "extract_flat": "in_playlist"},
+    "flat_playlist": {"format": "bestaudio/best", "quiet": False, "extract_flat": "in_playlist", "cachedir": False},
+    "playlist": {"format": "bestaudio/best", "quiet": False, "cachedir": False, "ignoreerrors": True},
+}
+
+# identical lookups that are already running, shared by every VideoSearcher
+inFlight = SingleFlight()
+
+# every extraction thread keeps its own warm YoutubeDL per profile, since an instance can't be shared between threads
+localInstances = threading.local()
+
+
+# function to get this thread's YoutubeDL for the given profile, building it the first time it's needed
+def getYoutubeDL(profile: str, cookies_path: Path) -> YoutubeDL:
+    instances = getattr(localInstances, "instances", None)
+    if instances is None:
+        instances = localInstances.instances = {}
+    key = (profile, str(cookies_path))
+    ytdlp = instances.get(key)
+    if ytdlp is None:
+        ytdlp = instances[key] = YoutubeDL({**PROFILES[profile], "cookies": cookies_path})
+    return ytdlp
+
 
 def getSongExpiration(url: str) -> int | None:
     parsed = urlparse(url)
@@ -28,110 +61,168 @@ class VideoSearcher:
     def __init__(self):
         root_dir = Path(__file__).resolve().parent.parent
         self.cookies_path = root_dir / "cookies.txt"
-
-    async def getVideoInfoFromURL(self, video_url):
-        loop = asyncio.get_running_loop()
+        self.cache = getMetadataCache()
+        self.scheduler = getExtractionScheduler()
+
+    # function to run a yt-dlp call at the given priority, started is called once a worker thread picks it up
+    async def runExtraction(self, priority, started, extract_info):
+        def job():
+            started()
+            return extract_info()
+
+        return await self.scheduler.run(priority, job)
+
+    # function to share a lookup with everyone asking for the same thing, an urgent caller joining one that's still
+    # queued behind a less urgent class gets it run at its own priority instead of waiting in that queue
+    async def shared(self, key, priority, extract):
+        return await inFlight.do(key, lambda started: extract(priority, started), PRIORITY_RANKS[priority])
+
+    # function to store freshly extracted video info in the metadata cache
+    def cacheVideoInfo(self, video_url, info):
+        self.cache.putVideo(canonicalId(video_url), video_url, info, getSongExpiration(info["link"]) if info.get("link") else None)
+
+    @timed(SEARCHER_LATENCY, method="getVideoInfoFromURL")
+    async def getVideoInfoFromURL(self, video_url, priority=INTERACTIVE, force=False):
+        # skip yt-dlp entirely if we still have a valid stream link for this video, unless a new one is wanted
+        key = canonicalId(video_url)
+        cached = None if force else self.cache.getVideo(key)
+        if cached and cached["link"]:
+            return cached
 
         def extract_info():
-            yt_dlp_options = {
-                "format": "bestaudio/best",
-                "quiet": True,
-                "noplaylist": True,
-                "cookies": self.cookies_path,
-                "cachedir": False,
+            ytdlp = getYoutubeDL("single", self.cookies_path)
+            info = ytdlp.extract_info(video_url, download=False)
+            return {
+                "title": re.sub(r"[^\w\s\-]", "", info.get("title", "")),
+                "duration": int(info.get("duration") or 0),  # in seconds
+                "thumbnail": info.get("thumbnail"),
+                "link": info.get("url"),
+                "codec": info.get("acodec"),
             }
-            with YoutubeDL(yt_dlp_options) as ytdlp:
-                info = ytdlp.extract_info(video_url, download=False)
-                return {
-                    "title": re.sub(r"[^\w\s\-]", "", info.get("title", "")),
-                    "duration": int(info.get("duration") or 0),  # in seconds
-                    "thumbnail": info.get("thumbnail"),
-                    "link": info.get("url"),
-                }
-
-        return await loop.run_in_executor(None, extract_info)
 
-    async def getVideoInfoFromQuery(self, video_query):
-        loop = asyncio.get_running_loop()
+        async def extract(priority, started):
+            result = await self.runExtraction(priority, started, extract_info)
+            self.cacheVideoInfo(video_url, result)
+            return result
+
+        # if someone else is already extracting this video, wait for their result instead
+        return await self.shared(("url", key), priority, extract)
+
+    @timed(SEARCHER_LATENCY, method="getVideoInfoFromQuery")
+    async def getVideoInfoFromQuery(self, video_query, priority=INTERACTIVE):
+        query = normalizeQuery(video_query)
+        cached = self.cache.getQuery(query)
+        if cached:
+            if cached["link"]:
+                return cached
+            # we already know which video this query finds, so only the stream link needs refreshing
+            result = await self.getVideoInfoFromURL(cached["url"], priority)
+            return {**result, "url": cached["url"]}
 
         def extract_info():
-            yt_dlp_options = {"format": "bestaudio/best", "quiet": True, "noplaylist": True, "cookies": self.cookies_path, "cachedir": False, "default_search": "ytsearch", "max_downloads": 1}
-            with YoutubeDL(yt_dlp_options) as ytdlp:
-                info = ytdlp.extract_info(f"{video_query} lyrics", download=False)
-                video = info["entries"][0] if "entries" in info else info
-                return {
-                    "title": re.sub(r"[^\w\s\-]", "", video.get("title", "")),
-                    "duration": int(video.get("duration") or 0),
-                    "thumbnail": video.get("thumbnail"),
-                    "link": video.get("url"),
-                    "url": video.get("webpage_url"),
-                }
-
-        return await loop.run_in_executor(None, extract_info)
+            ytdlp = getYoutubeDL("search", self.cookies_path)
+            info = ytdlp.extract_info(f"{video_query} lyrics", download=False)
+            video = info["entries"][0] if "entries" in info else info
+            return {
+                "title": re.sub(r"[^\w\s\-]", "", video.get("title", "")),
+                "duration": int(video.get("duration") or 0),
+                "thumbnail": video.get("thumbnail"),
+                "link": video.get("url"),
+                "codec": video.get("acodec"),
+                "url": video.get("webpage_url"),
+            }
 
-    async def getSearchResults(self, video_query):
-        loop = asyncio.get_running_loop()
+        async def extract(priority, started):
+            result = await self.runExtraction(priority, started, extract_info)
+            if result["url"]:
+                self.cacheVideoInfo(result["url"], result)
+                self.cache.putQuery(query, canonicalId(result["url"]))
+            return result
+
+        return await self.shared(("query", query), priority, extract)
+
+    @timed(SEARCHER_LATENCY, method="getVideoInfoFromSpotify")
+    async def getVideoInfoFromSpotify(self, track_id, video_query, need_link=True, priority=INTERACTIVE):
+        # a spotify track we've matched before skips the youtube search entirely
+        url = self.cache.getSpotifyMatch(track_id) if track_id else None
+        if url:
+            cached = self.cache.getVideo(canonicalId(url))
+            if cached and (cached["link"] or not need_link):
+                return cached
+            result = await self.getVideoInfoFromURL(url, priority)
+            return {**result, "url": url}
+
+        result = await self.getVideoInfoFromQuery(video_query, priority)
+        if track_id and result["url"]:
+            self.cache.putSpotifyMatch(track_id, result["url"])
+        return result
+
+    @timed(SEARCHER_LATENCY, method="getSearchResults")
+    async def getSearchResults(self, video_query, priority=INTERACTIVE):
+        query = normalizeQuery(video_query)
+        cached = self.cache.getSearch(query)
+        if cached:
+            return cached
 
         def extract_info():
-            yt_dlp_options = {
-                "format": "bestaudio/best",
-                "quiet": True,
-                "noplaylist": True,
-                "cookies": self.cookies_path,
-                "cachedir": False,
-                "default_search": "ytsearch10",
-                "ignoreerrors": True,
-                "extract_flat": "in_playlist",
-            }
-            with YoutubeDL(yt_dlp_options) as ytdlp:
-                info = ytdlp.extract_info(f"{video_query} lyrics", download=False)
-                entries = info["entries"] if "entries" in info else [info]
-
-                return [
-                    {
-                        "title": re.sub(r"[^\w\s\-]", "", entry.get("title", "")),
-                        "link": entry.get("url"),
-                    }
-                    for entry in entries
-                ]
+            ytdlp = getYoutubeDL("flat_search", self.cookies_path)
+            info = ytdlp.extract_info(f"{video_query} lyrics", download=False)
+            entries = info["entries"] if "entries" in info else [info]
+
+            return [
+                {
+                    "title": re.sub(r"[^\w\s\-]", "", entry.get("title", "")),
+                    "link": entry.get("url"),
+                }
+                for entry in entries
+            ]
 
-        return await loop.run_in_executor(None, extract_info)
+        async def extract(priority, started):
+            result = await self.runExtraction(priority, started, extract_info)
+            if result:
+                self.cache.putSearch(query, result)
+            return result
 
-    async def getPlaylistInfo(self, playlist_url):
-        loop = asyncio.get_running_loop()
+        return await self.shared(("search", query), priority, extract)
 
+    @timed(SEARCHER_LATENCY, method="getPlaylistInfo")
+    async def getPlaylistInfo(self, playlist_url, priority=INTERACTIVE):
         def extract_info():
-            yt_dlp_options = {"format": "bestaudio/best", "quiet": False, "extract_flat": "in_playlist", "cookies": self.cookies_path, "cachedir": False}
-            with YoutubeDL(yt_dlp_options) as ytdlp:
-                playlist = ytdlp.extract_info(playlist_url, download=False)
-                metadata = {
-                    "playlist_name": re.sub(r"[^\w\s\-]", "", playlist.get("title", "Unknown Playlist")),
-                    "song_count": len(playlist.get("entries", [])),
-                    "thumbnail": playlist.get("thumbnail") or (playlist.get("thumbnails", [{}])[0].get("url") if "thumbnails" in playlist else None),
+            ytdlp = getYoutubeDL("flat_playlist", self.cookies_path)
+            playlist = ytdlp.extract_info(playlist_url, download=False)
+            metadata = {
+                "playlist_name": re.sub(r"[^\w\s\-]", "", playlist.get("title", "Unknown Playlist")),
+                "song_count": len(playlist.get("entries", [])),
+                "thumbnail": playlist.get("thumbnail") or (playlist.get("thumbnails", [{}])[0].get("url") if "thumbnails" in playlist else None),
+            }
+            # keep the cheap flat info, the stream link is only looked up once the song is about to play
+            songs = [
+                {
+                    "url": entry.get("url"),
+                    "title": re.sub(r"[^\w\s\-]", "", entry.get("title") or "") or entry.get("url"),
+                    "duration": int(entry.get("duration") or 0),
+                    "thumbnail": entry.get("thumbnail") or (entry.get("thumbnails") or [{}])[-1].get("url"),
                 }
-                song_urls = [{"url": entry.get("url")} for entry in playlist.get("entries", []) if entry.get("url")]
-                return [metadata] + song_urls
+                for entry in playlist.get("entries", [])
+                if entry.get("url")
+            ]
+            return [metadata] + songs
 
-        return await loop.run_in_executor(None, extract_info)
+        # the caller pops the metadata off the front, so hand everyone their own copy of the shared list
+        async def extract(priority, started):
+            return await self.runExtraction(priority, started, extract_info)
 
-    async def getVideoInfoFromPlaylist(self, playlist_url):
-        loop = asyncio.get_running_loop()
+        return list(await self.shared(("playlist", canonicalId(playlist_url)), priority, extract))
 
+    @timed(SEARCHER_LATENCY, method="getVideoInfoFromPlaylist")
+    async def getVideoInfoFromPlaylist(self, playlist_url, priority=INTERACTIVE):
         def extract_info():
-            yt_dlp_options = {
-                "format": "bestaudio/best",
-                "quiet": False,
-                # 'extract_flat': 'in_playlist',
-                "cookies": self.cookies_path,
-                "cachedir": False,
-                "ignoreerrors": True,
-            }
-            with YoutubeDL(yt_dlp_options) as ytdlp:
-                playlist = ytdlp.extract_info(playlist_url, download=False)
-                return [
-                    {"title": re.sub(r"[^\w\s\-]", "", entry.get("title", "")), "duration": int(entry.get("duration") or 0), "thumbnail": entry.get("thumbnail"), "link": entry.get("url"), "url": entry.get("webpage_url")}
-                    for entry in playlist.get("entries", [])
-                    if entry
-                ]
-
-        return await loop.run_in_executor(None, extract_info)
+            ytdlp = getYoutubeDL("playlist", self.cookies_path)
+            playlist = ytdlp.extract_info(playlist_url, download=False)
+            return [
+                {"title": re.sub(r"[^\w\s\-]", "", entry.get("title", "")), "duration": int(entry.get("duration") or 0), "thumbnail": entry.get("thumbnail"), "link": entry.get("url"), "url": entry.get("webpage_url")}
+                for entry in playlist.get("entries", [])
+                if entry
+            ]
+
+        return await self.scheduler.run(priority, extract_info)
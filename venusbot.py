@@ -1,6 +1,8 @@
 import asyncio
+import collections
 import logging
 import os
+import time
 from pathlib import Path
 
 import discord
@@ -9,7 +11,15 @@ from dotenv import load_dotenv
 
 from embed_views.queue_view import QueueView
 from embed_views.search_view import SearchView
-from music_controller import MusicController
+from music_controller import MusicController, formatDuration
+from scripts import metrics, spotify
+from scripts.cache import getMetadataCache
+from scripts.extraction_scheduler import getExtractionScheduler
+from scripts.link_refresher import getLinkRefresher
+from scripts.message_scheduler import getMessageScheduler
+from scripts.resolvers import matchSource
+from scripts.snapshots import getSnapshotStore
+from scripts.title_index import getTitleIndex
 
 # set up logging
 logging.basicConfig(
@@ -21,6 +31,9 @@ logging.basicConfig(
 # block discords logging
 logging.getLogger("discord").setLevel(logging.WARNING)
 
+# seconds between checks for controllers that have been idle for too long
+CONTROLLER_SWEEP_INTERVAL = 60
+
 
 class VenusBot(discord.Client):
     def __init__(self):
@@ -33,23 +46,113 @@ class VenusBot(discord.Client):
         load_dotenv()
         self.token = os.getenv("DISCORD_TOKEN")
 
-        self.musicControllers = {}
-
-    # function to get the music controller for the specificied guild
+        # guild id -> music controller, least recently used first
+        self.musicControllers = collections.OrderedDict()
+        # idle controllers are let go of after this many seconds, or sooner once there are more than the limit
+        self.controllerTTL = max(0, int(os.getenv("CONTROLLER_IDLE_TTL", 1800)))
+        self.controllerLimit = max(1, int(os.getenv("CONTROLLER_LIMIT", 500)))
+        self.evictionTask = None
+        # queues saved by the last run, each one is restored the first time its guild's controller is needed
+        self.snapshots = getSnapshotStore()
+        self.restoreTask = None
+        self.titleIndexTask = None
+        # ids of the users who may use /stats, looked up from the application the first time it's needed
+        self.ownerIds = None
+        metrics.QUEUE_DEPTH.collect = lambda: {(str(guild_id),): len(controller.songQueue) for guild_id, controller in self.musicControllers.items()}
+
+    # function to get the music controller for the specificied guild, it's only created once a command needs it
     async def getGuildMusicController(self, guild: discord.Guild):
-        if guild.id not in self.musicControllers:
-            self.musicControllers[guild.id] = MusicController(client=self, guild=guild)
-        return self.musicControllers[guild.id]
+        musicController = self.musicControllers.get(guild.id)
+        if musicController is None:
+            musicController = self.musicControllers[guild.id] = MusicController(client=self, guild=guild)
+            snapshot = self.snapshots.pending.pop(guild.id, None)
+            if snapshot is not None:
+                musicController.restoreSnapshot(snapshot)
+            if len(self.musicControllers) > self.controllerLimit:
+                self.evictIdleControllers(keep=guild.id)
+        else:
+            self.musicControllers.move_to_end(guild.id)
+        musicController.lastUsed = time.monotonic()
+        return musicController
 
     # function to pop the music controller for the specificied guild
     async def popGuildMusicController(self, guild: discord.Guild):
         if guild.id in self.musicControllers:
             self.musicControllers.pop(guild.id)
 
+    # function to let go of idle controllers, the ones unused for longer than the TTL and, while there are more than
+    # the limit, the least recently used ones. A 24/7 channel is remembered as a pending snapshot, like after a restart
+    def evictIdleControllers(self, keep: int = None) -> int:
+        now = time.monotonic()
+        evicted = 0
+        for guild_id, musicController in list(self.musicControllers.items()):
+            overLimit = len(self.musicControllers) > self.controllerLimit
+            if guild_id == keep:
+                continue
+            if not musicController.isIdle():
+                # the TTL counts from when the controller stopped being busy
+                musicController.lastUsed = now
+                continue
+            if overLimit:
+                reason = "limit"
+            elif now - musicController.lastUsed >= self.controllerTTL:
+                reason = "ttl"
+            else:
+                continue
+            del self.musicControllers[guild_id]
+            musicController.discardNextUp()
+            if musicController.snapshotSignature() is not None:
+                self.snapshots.pending[guild_id] = musicController.toSnapshot()
+            metrics.CONTROLLER_EVICTIONS.inc(reason=reason)
+            evicted += 1
+        if evicted:
+            logging.info(f"Let go of {evicted} idle music controllers, {len(self.musicControllers)} left")
+        return evicted
+
+    async def watchIdleControllers(self):
+        while True:
+            await asyncio.sleep(CONTROLLER_SWEEP_INTERVAL)
+            try:
+                self.evictIdleControllers()
+            except Exception as e:
+                logging.error(f"Unable to evict idle music controllers: {e}")
+
+    async def setup_hook(self):
+        self.snapshots.start(self.musicControllers)
+        self.evictionTask = asyncio.create_task(self.watchIdleControllers())
+        await metrics.startMetricsServer()
+        # /play suggestions work as soon as the titles from earlier runs are indexed
+        self.titleIndexTask = asyncio.create_task(getTitleIndex().load())
+
+    # function to check if a user owns the bot, or is on the team that does
+    async def isOwner(self, user: discord.abc.User) -> bool:
+        if self.ownerIds is None:
+            app = await self.application_info()
+            self.ownerIds = {member.id for member in app.team.members} if app.team else {app.owner.id}
+        return user.id in self.ownerIds
+
     async def on_ready(self):
         logging.info(f"{self.user} is now running.")
         await bot.tree.sync()
         logging.info("commands synced")
+        # on_ready fires again after reconnects, the snapshots only need restoring once
+        if self.restoreTask is None:
+            self.restoreTask = asyncio.create_task(self.restoreSnapshots())
+
+    # function to rejoin the channels the bot was playing in before it restarted, one guild at a time
+    async def restoreSnapshots(self):
+        for guild_id, snapshot in list(self.snapshots.pending.items()):
+            # guilds the bot wasn't connected in get their controller back the first time it's needed
+            if not snapshot["connected"]:
+                continue
+            guild = self.get_guild(guild_id)
+            if guild is None:
+                continue
+            musicController = await self.getGuildMusicController(guild)
+            try:
+                await musicController.rejoinAfterRestart()
+            except Exception as e:
+                logging.error(f"Unable to rejoin {guild.name} after restart: {e}")
 
     async def on_connect(self):
         logging.info(f"{self.user} has connected.")
@@ -57,6 +160,19 @@ class VenusBot(discord.Client):
     async def start_bot(self):
         await self.start(self.token)
 
+    async def close(self):
+        if self.evictionTask is not None:
+            self.evictionTask.cancel()
+        await self.snapshots.close(self.musicControllers)
+        getLinkRefresher().close()
+        getTitleIndex().close()
+        getMetadataCache().close()
+        # drop queued yt-dlp lookups so they don't hold up the exit, ones already running are left to finish on their own
+        getExtractionScheduler().shutdown()
+        await metrics.stopMetricsServer()
+        await spotify.closeSession()
+        await super().close()
+
 
 bot = VenusBot()
 
@@ -68,8 +184,14 @@ async def on_voice_state_update(member, before, after):
     if member == bot.user:
         return
 
-    # grab the musicController
-    musicController = await bot.getGuildMusicController(member.guild)
+    # grab the musicController, guilds that never used the bot don't get one just because someone joined a channel
+    musicController = bot.musicControllers.get(member.guild.id)
+    if musicController is None:
+        # a guild whose idle controller was let go still has its 24/7 channel remembered
+        snapshot = bot.snapshots.pending.get(member.guild.id)
+        if snapshot is None or snapshot["voice"] not in (getattr(before.channel, "id", None), getattr(after.channel, "id", None)):
+            return
+        musicController = await bot.getGuildMusicController(member.guild)
     # grab the voice and text channel
     voiceChannel, textChannel = musicController.getVideoAndTextChannel()
     # check if bot is set to a channel
@@ -124,6 +246,21 @@ async def play(interaction: discord.Interaction, query: str):
     return
 
 
+# suggest songs that were played before while /play is typed, picking one plays its link so no search is needed
+@play.autocomplete("query")
+async def play_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    if len(current.strip()) < 2 or matchSource(current) is not None:
+        return []
+    choices = []
+    for title, url, duration in getTitleIndex().search(current):
+        # discord allows at most 100 characters for both the name and the value
+        if len(url) > 100:
+            continue
+        length = f" ({formatDuration(duration)})" if duration else ""
+        choices.append(app_commands.Choice(name=f"{title[: 100 - len(length)]}{length}", value=url))
+    return choices
+
+
 @bot.tree.command(name="247", description="Enables 24/7 Mode.")
 async def two_four_seven(interaction: discord.Interaction, channel: discord.VoiceChannel):
     logging.info(f"{interaction.user.name} has activated /247")
@@ -257,7 +394,7 @@ async def queue(interaction: discord.Interaction):
         return
 
     # grab the QueueView Class
-    view = QueueView(queue, bot, interaction.user)
+    view = QueueView(queue, bot, interaction.user, musicController)
     # send the discord embed for the queue
     await view.send_page(interaction, first_response=True)
     logging.debug(f"/queue from {interaction.user.name} has ended")
@@ -278,7 +415,7 @@ async def search(interaction: discord.Interaction, query: str):
         await interaction.channel.send("Failed to search youtube.", ephemeral=True, delete_after=5)
         return
     # grab the SearchView Class
-    view = SearchView(result, musicController, bot)
+    view = SearchView(result, bot)
     # send the discord embed for the search
     await view.send_page(interaction)
     logging.debug(f"/search from {interaction.user.name} has ended")
@@ -300,6 +437,37 @@ async def volume(interaction: discord.Interaction, volume: app_commands.Range[in
     return
 
 
+@bot.tree.command(name="stats", description="Show the bot's performance stats (owner only).")
+async def stats(interaction: discord.Interaction):
+    logging.info(f"{interaction.user.name} has activated /stats")
+    if not await bot.isOwner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can use this.", ephemeral=True, delete_after=5)
+        return
+
+    embed = discord.Embed(
+        title="Stats",
+        color=0xA600FF,
+    )
+    queued = sum(len(controller.songQueue) for controller in bot.musicControllers.values())
+    remembered = len(bot.snapshots.pending)
+    embed.add_field(name="Guilds", value=f"{len(bot.musicControllers)} controllers, {remembered} idle guilds remembered, {queued} songs queued", inline=False)
+    embed.add_field(name="Extractions running", value=", ".join(f"{name}: {active}" for name, active in getExtractionScheduler().stats().items()), inline=False)
+    cacheStats = getMetadataCache().stats()
+    if cacheStats:
+        embed.add_field(name="Metadata cache", value="\n".join(f"{kind}: {counts['hits']} hits, {counts['misses']} misses" for kind, counts in cacheStats.items()), inline=False)
+    outbox = getMessageScheduler()
+    embed.add_field(name="Messages", value=f"{outbox.sent} sent, {outbox.merged} merged, {outbox.dropped} dropped", inline=False)
+    refresher = getLinkRefresher()
+    embed.add_field(name="Stream links", value=f"{len(refresher.links)} stored, {refresher.refreshed} refreshed early, {refresher.failed} refreshes failed", inline=False)
+    for name, value in metrics.summary():
+        # embed fields hold at most 1024 characters
+        embed.add_field(name=name, value=value[:1024], inline=False)
+    embed.set_thumbnail(url=bot.user.avatar.url)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+    logging.debug(f"/stats from {interaction.user.name} has ended")
+    return
+
+
 @bot.tree.command(name="help", description="List of all commands.")
 async def help(interaction: discord.Interaction):
     embed = discord.Embed(